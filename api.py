@@ -1,22 +1,32 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import RedirectResponse
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, EmailStr, Field
-from pymongo import MongoClient, errors
+from fastapi.responses import RedirectResponse, FileResponse, StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, EmailStr, Field, ValidationError
+from pymongo import UpdateOne, errors
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
+from database import db, users_repo, news_repo, good_deeds_repo, replies_repo, geocodes_repo, check_connection
+from indexes import ensure_indexes
+import leaderboard
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+from projection import (
+    NEWS_FIELDS, NEWS_SUMMARY_FIELDS, GOOD_DEED_FIELDS, GOOD_DEED_SUMMARY_FIELDS,
+    selected_fields, project_stage, strip_kept
+)
+from geocoding import ReverseGeocoder, location_for_city
+from ingestion import GLOBAL_CITIES, fetch_candidate_news, keep_positive, ingest_city
+from audio_cache import AudioCache
+from response_cache import news_cache
+from compression import CompressionMiddleware
+from rate_limit import openai_limiter
 from typing import Optional, Dict, List, Any
 from datetime import datetime
-from pathlib import Path
-from openai import OpenAI
-from difflib import SequenceMatcher
+from openai import AsyncOpenAI
 import os
+import asyncio
 import random
-import time
-import requests
-from pprint import pprint
 from datetime import datetime, timedelta
 
 # Load environment variables
@@ -30,6 +40,9 @@ OPEN_AI_API_ENDPOINT = os.getenv("OPEN_AI_API_ENDPOINT")
 OPEN_AI_API_KEY = os.getenv("OPEN_AI_API_KEY")  
 API_BASE_URL = os.getenv("API_BASE_URL")
 
+# Largest number of items one /bulk request may carry
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", 5000))
+
 app = FastAPI()
 
 origins = [
@@ -45,31 +58,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
+# brotli or gzip for larger responses, negotiated per request
+app.add_middleware(CompressionMiddleware)
+
 
-# MongoDB connection setup
-MONGODB_URI = os.getenv('MONGODB_URI')
-
-# Connect to MongoDB
-try:
-    client = MongoClient(MONGODB_URI)
-    print("Databases available:")
-    print(client.list_database_names())
-    db = client.get_database("HappyNest")  # HappyNest database
-    users_collection = db.get_collection("users")
-    news_collection = db.get_collection("news")
-    good_deeds_collection = db.get_collection("good_deeds")
-    replies_collection = db.get_collection("replies")
-
-    client.server_info()  # Force the client to connect to the server
-    print("Connected successfully to the 'HappyNest' database!")
-except errors.ConnectionFailure as e:
-    print(f"Could not connect to MongoDB: {e}")
-    exit(1)
-except Exception as e:
-    print(f"An error occurred: {e}")
-    exit(1)
+@app.on_event("startup")
+async def connect_to_database():
+    await check_connection()
+    await ensure_indexes(db)
+    await leaderboard.backfill_if_empty()
 
 # Models
 class Location(BaseModel):
@@ -118,6 +118,113 @@ class NewsResponse(BaseModel):
     news: List[NewsArticle]
     audio: Any = None
 
+# Older articles were stored without state, country or coordinates
+def stored_location(location: Dict) -> Dict:
+    if location.get("state") in (None, "Unknown"):
+        return location_for_city(location.get("city"))
+    return location
+
+# News documents as the news endpoints return them
+def news_article(article: Dict) -> Dict:
+    return {
+        "title": article["title"],
+        "content": article["content"],
+        "location": stored_location(article["location"]),
+        "published_at": article["published_at"],
+        "source": article["source"],
+        "id": str(article["_id"])
+    }
+
+# Projected articles that include the whole location get the same fill-in
+def fill_locations(articles: List[Dict]):
+    for article in articles:
+        if "state" in article.get("location", {}):
+            article["location"] = stored_location(article["location"])
+
+# Shuffle the same result set the same way every time, so a response body
+# (and with it its ETag) only changes when the articles change
+def shuffle_articles(articles: List[Dict]):
+    random.Random("".join(article["id"] for article in articles)).shuffle(articles)
+
+# Serve a cached JSON response, or 304 when the client already has it.
+# `build` returns the payload and the headers to keep with it.
+async def cached_json(request: Request, key, build):
+    entry = news_cache.get(key)
+    if entry is None:
+        generation = news_cache.generation
+        payload, headers = await build()
+        entry = news_cache.set(key, payload, headers, generation)
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache", **entry.headers}
+    if entry.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+# Helper function for keyset-paginated list endpoints: returns one page and
+# puts the cursor of the next page in the X-Next-Cursor response header
+# (`stages` runs the page through an aggregation instead of a plain find)
+async def find_page(repo, response: Response, query=None, sort=None, limit=DEFAULT_PAGE_SIZE, after=None, stages=None):
+    try:
+        if stages is not None:
+            documents, next_cursor = await repo.aggregate_page(stages, query, sort=sort, limit=limit, after=after)
+        else:
+            documents, next_cursor = await repo.find_page(query, sort=sort, limit=limit, after=after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return documents
+
+# The next-page cursor that find_page put on `response`, for responses built by hand
+def cursor_headers(response: Response) -> Dict:
+    if NEXT_CURSOR_HEADER in response.headers:
+        return {NEXT_CURSOR_HEADER: response.headers[NEXT_CURSOR_HEADER]}
+    return {}
+
+# fields= / view=summary of a list endpoint; unknown fields are a 400
+def requested_fields(view: str, fields: Optional[str], allowed, summary) -> Optional[List[str]]:
+    try:
+        return selected_fields(view, fields, allowed, summary)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Bulk endpoints: validate every item on its own so one bad item doesn't
+# reject the batch. Returns the valid models by index and a result list with
+# the validation errors filled in.
+def validate_items(model, items: List[Dict]):
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ITEMS} items per request")
+    valid = {}
+    results = [None] * len(items)
+    for index, item in enumerate(items):
+        try:
+            valid[index] = model(**item)
+        except ValidationError as e:
+            detail = [{"loc": list(error["loc"]), "msg": error["msg"]} for error in e.errors()]
+            results[index] = {"index": index, "status": "invalid", "detail": detail}
+    return valid, results
+
+# Write the documents (keyed by item index) with one unordered insert_many,
+# record each outcome in `results` and return the indexes that were stored
+async def insert_items(repo, documents: Dict[int, Dict], results: List) -> List[int]:
+    indexes = list(documents)
+    failed = {}
+    if indexes:
+        try:
+            await repo.insert_many([documents[index] for index in indexes], ordered=False)
+        except errors.BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[indexes[error["index"]]] = error.get("errmsg", "Write failed")
+    for index in indexes:
+        if index in failed:
+            results[index] = {"index": index, "status": "error", "detail": failed[index]}
+        else:
+            results[index] = {"index": index, "status": "created", "id": str(documents[index]["_id"])}
+    return [index for index in indexes if index not in failed]
+
+def bulk_response(results: List) -> Dict:
+    created = sum(1 for result in results if result["status"] == "created")
+    return {"created": created, "failed": len(results) - created, "results": results}
+
 # Helper function to handle ObjectId conversion
 def str_to_objectid(id_str: str) -> ObjectId:
     try:
@@ -126,141 +233,14 @@ def str_to_objectid(id_str: str) -> ObjectId:
         raise HTTPException(status_code=400, detail="Invalid ObjectId format")
     
     
-def get_auth_header(username, password, appid):
-    # Generate the authorization header for making requests to the Aylien API.
-    token = requests.post('https://api.aylien.com/v1/oauth/token', auth=(username, password), data={'grant_type': 'password'})
-    token = token.json()['access_token']
-    headers = {f'Authorization': 'Bearer {}'.format(token), 'AppId': appid}
-    return headers
-# Function to calculate similarity
-def similar(a, b):
-    return SequenceMatcher(None, a, b).ratio()
-# Function to remove duplicates based on a given threshold
-def remove_duplicates(stories, threshold=0.5):
-    unique_stories = []
-    seen_titles = []
-    for story in stories:
-        title = story['title']
-        if not any(similar(title, seen_title) > threshold for seen_title in seen_titles):
-            unique_stories.append(story)
-            seen_titles.append(title)
-    return unique_stories
-def get_top_stories(params, headers, n_top_stories=False):
-    fetched_stories = []
-    stories = None
-    if 'per_page' in params.keys():
-        if params['per_page'] > n_top_stories and not n_top_stories == False:
-            params['per_page'] = n_top_stories
-    while (
-        stories is None
-        or len(stories) > 0
-        and (len(fetched_stories) < n_top_stories or n_top_stories == False)
-    ):
-        try:
-            response = requests.get('https://api.aylien.com/v6/news/stories', params=params, headers=headers)
-            # If the call is successfull it will append it
-            if response.status_code == 200:
-                response_json = response.json()
-                stories = response_json['stories']
-                if 'next_page_cursor' in response_json.keys():
-                    params['cursor'] = response_json['next_page_cursor']
-                else:
-                    pprint('No next_page_cursor')
-                fetched_stories += stories
-                if len(stories) > 0 and not stories == None:
-                    print(
-                        'Fetched %d stories. Total story count so far: %d'
-                        % (len(stories), len(fetched_stories))
-                    )
-            # If the application reached the limit per minute it will sleep and retry until the limit is reset
-            elif response.status_code == 429:
-                time.sleep(10)
-                continue
-            # If the API call face network or server errors it sleep for few minutes and try again a few times until completely stop the script.
-            elif 500 <= response.status_code <= 599:
-                time.sleep(260)
-                continue
-            # If the API call return any other status code it return the error for futher investigation and stop the script.
-            else:
-                pprint(response.text)
-                break
-        except Exception as e:
-            # In case the code fall in any exception error.
-            pprint(e)
-            break
-    return fetched_stories
-headers = {
-    "Content-Type": "application/json",
-    "Authorization": f"Bearer {OPEN_AI_API_KEY}"
-}
-def is_political(text: str) -> bool:
-    messages = [
-        {"role": "system", "content": "You are a helpful assistant that determines if text is related to politics and you just answer in one word."},
-        {"role": "user", "content": f"Is this text related to politics? Answer with just 'yes' or 'no':\n\n{text}"}
-    ]
-    
-    data = {
-        "model": "gpt-3.5-turbo", 
-
-        "messages": messages,
-        "max_tokens": 10,
-        "temperature": 0.3,
-        "top_p": 1,
-        "frequency_penalty": 0,
-        "presence_penalty": 0,
-        "stop": None,
-        "stream": False
-    }
-
-    response = requests.post(OPEN_AI_API_ENDPOINT, headers=headers, json=data)
-    
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=f"Error from Azure OpenAI API: {response.text}")
-    
-    result = response.json()
-    is_political = result["choices"][0]["message"]["content"].strip().lower() == "yes"
-    return is_political
-
-def analyze_sentiment(text: str) -> str:
-
-    messages = [
-        {"role": "system", "content": "You are a helpful assistant that performs sentiment analysis."},
-        {"role": "user", "content": f"Analyze the sentiment of this text and return just one word, 'positive' if it's happy or positive, else return 'negative' if it's sad or dangerous otherwise 'neutral':\n\n{text}"}
-
-    ]
-    
-    data = {
-        "model": "gpt-3.5-turbo",  
-
-        "messages": messages,
-        "max_tokens":800,  
-        "temperature":0.7,  
-        "top_p":0.95,  
-        "frequency_penalty":0,  
-        "presence_penalty":0,  
-        "stop": None,  
-        "stream": False  
-    }
-
-    response = requests.post(OPEN_AI_API_ENDPOINT, headers=headers, json=data)
-    
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=f"Error from OpenAI API: {response.text}")
-        
-    
-    result = response.json()
-    sentiment = result["choices"][0]["message"]["content"].strip().lower()
-    if sentiment == "positive" and is_political(text):
-        return "neutral"
-    
-    return sentiment
+reverse_geocoder = ReverseGeocoder(geocodes_repo)
 
 # User Endpoints
 @app.post("/api/users/")
 async def create_user(user_data: dict):
    try:
        # Check if user exists
-       existing_user = users_collection.find_one({"_id": user_data["_id"]})
+       existing_user = await users_repo.find_one({"_id": user_data["_id"]})
        if existing_user:
            return {"message": "User already exists"}
 
@@ -268,15 +248,15 @@ async def create_user(user_data: dict):
        user_data["created_at"] = datetime.now()
        
        # Insert new user
-       result = users_collection.insert_one(user_data)
+       result = await users_repo.insert_one(user_data)
        return {"id": user_data["_id"]}
        
    except Exception as e:
        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/users/", response_model=List[User])
-async def get_all_users():
-    users = list(users_collection.find())
+async def get_all_users(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
+    users = await find_page(users_repo, response, limit=limit, after=after)
     for user in users:
         user["id"] = str(user["_id"])
         del user["_id"]
@@ -284,7 +264,7 @@ async def get_all_users():
 
 @app.get("/api/users/{user_id}", response_model=User)
 async def get_user(user_id: str):
-    user = users_collection.find_one({"_id": user_id})
+    user = await users_repo.find_one({"_id": user_id})
     if user:
         user["id"] = str(user["_id"])
         del user["_id"]
@@ -295,81 +275,141 @@ async def get_user(user_id: str):
 @app.put("/api/users/{user_id}")
 async def update_user(user_id: str, user: User):
     user_objectid = str_to_objectid(user_id)
-    update_result = users_collection.update_one(
+    update_result = await users_repo.update_one(
         {"_id": user_objectid},
         {"$set": user.dict(exclude_unset=True)}
     )
     if update_result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    await leaderboard.refresh_user(user_id, user.dict(exclude_unset=True))
     return {"detail": "User updated successfully"}
 
 @app.delete("/api/users/{user_id}")
 async def delete_user(user_id: str):
     user_objectid = str_to_objectid(user_id)
-    delete_result = users_collection.delete_one({"_id": user_objectid})
+    delete_result = await users_repo.delete_one({"_id": user_objectid})
     if delete_result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    await leaderboard.remove_user(user_id)
     return {"detail": "User deleted successfully"}
 
 # Good Deed Endpoints
+def deed_city(good_deed_data):
+    return (good_deed_data.get("location") or {}).get("city")
+
 @app.post("/api/good-deeds/")
 async def create_good_deed(good_deed: GoodDeed):
     good_deed_data = good_deed.dict()
     good_deed_data["completed_at"] = datetime.now()
     good_deed_data["replies"] = []
-    result = good_deeds_collection.insert_one(good_deed_data)
+    result = await good_deeds_repo.insert_one(good_deed_data)
+    await leaderboard.record_deed(
+        good_deed_data["user_id"],
+        completed_at=good_deed_data["completed_at"],
+        city=deed_city(good_deed_data)
+    )
     return {"id": str(result.inserted_id)}
 
+@app.post("/api/good-deeds/bulk")
+async def create_good_deeds(items: List[Dict[str, Any]]):
+    valid, results = validate_items(GoodDeed, items)
+    documents = {}
+    for index, good_deed in valid.items():
+        good_deed_data = good_deed.dict()
+        good_deed_data["completed_at"] = datetime.now()
+        good_deed_data["replies"] = []
+        documents[index] = good_deed_data
+    created = await insert_items(good_deeds_repo, documents, results)
+    await leaderboard.record_deeds([
+        (documents[index]["user_id"], documents[index]["completed_at"], deed_city(documents[index]))
+        for index in created
+    ])
+    return bulk_response(results)
+
+# Aggregation stages that join each good deed with its replies (through the
+# replies.deed_id index) and shape the ids the way the response models expect
+def good_deed_stages(reply_limit: Optional[int] = None) -> List[Dict]:
+    reply_pipeline = [{"$sort": {"created_at": 1, "_id": 1}}]
+    if reply_limit:
+        reply_pipeline.append({"$limit": reply_limit})
+    reply_pipeline.append({"$addFields": {"_id": {"$toString": "$_id"}}})
+    return [
+        {"$addFields": {"id": {"$toString": "$_id"}}},
+        {"$lookup": {
+            "from": "replies",
+            "localField": "id",
+            "foreignField": "deed_id",
+            "pipeline": reply_pipeline,
+            "as": "replies"
+        }}
+    ]
+
 @app.get("/api/good-deeds/", response_model=List[GoodDeed])
-async def get_all_good_deeds():
-    good_deeds = list(good_deeds_collection.find())
-    for deed in good_deeds:
-        deed["id"] = str(deed["_id"])
-        del deed["_id"]
-        # Convert reply IDs to actual reply objects
-        if "replies" in deed:
-            reply_ids = [str_to_objectid(rid) for rid in deed["replies"]]
-            deed["replies"] = list(replies_collection.find({"_id": {"$in": reply_ids}}))
-            # Clean up reply objects
-            for reply in deed["replies"]:
-                reply["id"] = str(reply["_id"])
-                del reply["_id"]
-    return good_deeds
+async def get_all_good_deeds(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    reply_limit: Optional[int] = Query(None, ge=1),
+    view: str = Query("full", pattern="^(full|summary)$"),
+    fields: Optional[str] = None
+):
+    selected = requested_fields(view, fields, GOOD_DEED_FIELDS, GOOD_DEED_SUMMARY_FIELDS)
+    if selected is None:
+        # One aggregation per page: the deeds and all of their replies in a single round trip
+        return await find_page(good_deeds_repo, response, limit=limit, after=after, stages=good_deed_stages(reply_limit))
+
+    # Replies are only joined when they were asked for
+    stages = good_deed_stages(reply_limit) if "replies" in selected else []
+    stages.append(project_stage(selected, keep=["_id"]))
+    good_deeds = await find_page(good_deeds_repo, response, limit=limit, after=after, stages=stages)
+    strip_kept(good_deeds, selected, ["_id"])
+    # Partial documents don't fit the GoodDeed response model
+    return JSONResponse(jsonable_encoder(good_deeds), headers=cursor_headers(response))
 
 @app.get("/api/good-deeds/{deed_id}", response_model=GoodDeed)
-async def get_good_deed(deed_id: str):
+async def get_good_deed(deed_id: str, reply_limit: Optional[int] = Query(None, ge=1)):
     deed_objectid = str_to_objectid(deed_id)
-    good_deed = good_deeds_collection.find_one({"_id": deed_objectid})
-    if good_deed:
-        good_deed["id"] = str(good_deed["_id"])
-        del good_deed["_id"]
-        # Fetch associated replies
-        reply_ids = good_deed.get("replies", [])
-        good_deed["replies"] = [
-            {**reply, "_id": str(reply["_id"])}
-            for reply in replies_collection.find({"_id": {"$in": reply_ids}})
-        ]
-        return good_deed
+    good_deeds = await good_deeds_repo.aggregate([{"$match": {"_id": deed_objectid}}] + good_deed_stages(reply_limit))
+    if good_deeds:
+        return good_deeds[0]
     else:
         raise HTTPException(status_code=404, detail="Good deed not found")
 
 @app.put("/api/good-deeds/{deed_id}")
 async def update_good_deed(deed_id: str, good_deed: GoodDeed):
     deed_objectid = str_to_objectid(deed_id)
-    update_result = good_deeds_collection.update_one(
+    update = good_deed.dict(exclude_unset=True)
+    previous_deed = await good_deeds_repo.find_one_and_update(
         {"_id": deed_objectid},
-        {"$set": good_deed.dict(exclude_unset=True)}
+        {"$set": update},
+        {"user_id": 1, "completed_at": 1, "location.city": 1}
     )
-    if update_result.modified_count == 0:
+    if previous_deed is None:
         raise HTTPException(status_code=404, detail="Good deed not found")
+    # Move the deed's count when it changed user, day or city
+    updated_deed = {**previous_deed, **update}
+    before = (previous_deed["user_id"], leaderboard.day_bucket(previous_deed.get("completed_at") or datetime.now()), deed_city(previous_deed))
+    after = (updated_deed["user_id"], leaderboard.day_bucket(updated_deed.get("completed_at") or datetime.now()), deed_city(updated_deed))
+    if before != after:
+        await leaderboard.record_deed(previous_deed["user_id"], -1, completed_at=previous_deed.get("completed_at"), city=deed_city(previous_deed))
+        await leaderboard.record_deed(updated_deed["user_id"], completed_at=updated_deed.get("completed_at"), city=deed_city(updated_deed))
     return {"detail": "Good deed updated successfully"}
 
 @app.delete("/api/good-deeds/{deed_id}")
 async def delete_good_deed(deed_id: str):
     deed_objectid = str_to_objectid(deed_id)
-    delete_result = good_deeds_collection.delete_one({"_id": deed_objectid})
-    if delete_result.deleted_count == 0:
+    deleted_deed = await good_deeds_repo.find_one_and_delete(
+        {"_id": deed_objectid},
+        {"user_id": 1, "completed_at": 1, "location.city": 1}
+    )
+    if deleted_deed is None:
         raise HTTPException(status_code=404, detail="Good deed not found")
+    await leaderboard.record_deed(
+        deleted_deed["user_id"],
+        -1,
+        completed_at=deleted_deed.get("completed_at"),
+        city=deed_city(deleted_deed)
+    )
     return {"detail": "Good deed deleted successfully"}
 
 # News Article Endpoints
@@ -379,82 +419,58 @@ async def create_news(news: NewsArticle):
         news_data = news.dict()
         # print(f"Received news data: {news.dict()}")
         news_data["published_at"] = datetime.now()
-        result = news_collection.insert_one(news_data)
+        result = await news_repo.insert_one(news_data)
+        news_cache.invalidate()
         return {"id": str(result.inserted_id)}
+    except errors.DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A news article with this source already exists")
     except Exception as e:
         print(f"Error creating news: {str(e)}")
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
-os.makedirs('audio', exist_ok=True)
-
-app.mount("/audio", StaticFiles(directory="audio"), name="audio")
-
-
-
-client2 = OpenAI(api_key=os.getenv("OPEN_AI_API_KEY"))
+@app.post("/api/news/bulk")
+async def create_news_bulk(items: List[Dict[str, Any]]):
+    valid, results = validate_items(NewsArticle, items)
+    documents = {}
+    for index, news in valid.items():
+        news_data = news.dict()
+        news_data["published_at"] = datetime.now()
+        documents[index] = news_data
+    # Articles whose source is already stored fail on the unique source index
+    created = await insert_items(news_repo, documents, results)
+    if created:
+        news_cache.invalidate()
+    return bulk_response(results)
+
+
+# No SDK retries: a 429 has to reach the shared limiter instead of being retried while holding its slot
+tts_client = AsyncOpenAI(api_key=os.getenv("OPEN_AI_API_KEY"), max_retries=0)
+audio_cache = AudioCache(limiter=openai_limiter)
+
+@app.get("/api/audio/{audio_key}")
+async def get_audio(audio_key: str):
+    if not audio_cache.is_valid_key(audio_key):
+        raise HTTPException(status_code=404, detail="Audio not found")
+    cached_path = audio_cache.cached_audio(audio_key)
+    if cached_path:
+        return FileResponse(cached_path, media_type="audio/mpeg")
+    script = audio_cache.load_script(audio_key)
+    if script is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    # First play: relay the TTS stream straight to the client while caching it
+    return StreamingResponse(audio_cache.stream(tts_client, audio_key, script), media_type="audio/mpeg")
 
 @app.get("/api/news/global-fetch", response_model=NewsResponse)
 async def fetch_news_global():
     try:
-        cities = [
-            "New York", "Los Angeles", "Chicago", "San Francisco", "Miami", "Houston", "Boston", "Seattle",
-            "London", "Paris", "Berlin", "Rome", "Madrid", "Barcelona", "Amsterdam", "Vienna", "Zurich",
-            "Tokyo", "Osaka", "Kyoto", "Seoul", "Beijing", "Shanghai", "Hong Kong", "Singapore", 
-            "Sydney", "Melbourne", "Brisbane", "Auckland", "Toronto", "Vancouver", "Montreal", "Ottawa",
-            "Dubai", "Abu Dhabi", "Cairo", "Cape Town", "Lagos", "Nairobi", "Mumbai", "Delhi", "Bangalore",
-            "Mexico City", "Buenos Aires", "Rio de Janeiro", "Sao Paulo", "Lima", "Bogota", "Caracas", 
-            "Jakarta", "Manila", "Kuala Lumpur", "Bangkok", "Ho Chi Minh City", "Istanbul"
-        ]
-        
-        selected_cities = random.sample(cities, k=4)
+        selected_cities = random.sample(GLOBAL_CITIES, k=4)
         print(f"Fetching news for cities: {selected_cities}")
 
-        all_news = []
-
-        for city in selected_cities:
-            headers = get_auth_header(USERNAME, PASSWORD, APP_ID)
-            params = {
-                "published_at": "[NOW-14DAYS/HOUR TO NOW/HOUR]",
-                "language": "(en)",
-                "entities": '{{element:title AND surface_forms:"' + city + '" AND type:("Location", "City")}}',
-                "sort_by": "published_at",
-                "per_page": 11,
-            }
-
-            stories = get_top_stories(params, headers, 11)
-            if not stories:
-                continue
-
-            deduplicated_stories = remove_duplicates(stories, threshold=0.5)
-
-            for story in deduplicated_stories:
-                try:
-                    news_data = {
-                        "title": story["title"],
-                        "content": story["body"],
-                        "location": {
-                            "city": city,
-                            "state": "Unknown",
-                            "country": "Unknown",
-                            "coordinates": {
-                                "latitude": 0,
-                                "longitude": 0
-                            }
-                        },
-                        "published_at": datetime.utcnow(),
-                        "source": story["links"]["permalink"],
-                        "id": str(ObjectId())
-                    }
-
-                    sentiment = analyze_sentiment(news_data["content"])
-                    news_data["sentiment"] = sentiment
-
-                    if sentiment == "positive":
-                        all_news.append(news_data)
-
-                except Exception as story_error:
-                    # print(f"Error processing story: {story_error}")
-                    continue
+        city_news = await asyncio.gather(*(fetch_candidate_news(city, n_stories=11) for city in selected_cities))
+        candidate_news = [news_data for news in city_news for news_data in news]
+
+        # Classify the stories of every city at once instead of one by one
+        all_news = await keep_positive(candidate_news)
 
         random.shuffle(all_news)
         combined_news_content = (
@@ -468,19 +484,10 @@ async def fetch_news_global():
             "That wraps up today's HappyNest Radio broadcast. "
             "Thank you for tuning in, and remember to spread kindness and stay informed!"
         )
-        speech_file_path = Path("audio") / "combined_news_audio.mp3"
-        os.makedirs("audio", exist_ok=True)
-
-        response = client2.audio.speech.create(
-            model="tts-1",
-            voice="alloy",
-            input=combined_news_content
-        )
+        # The audio is synthesized (or served from cache) when the client plays it
+        audio_key = audio_cache.register(combined_news_content)
 
-        response.stream_to_file(speech_file_path)
-
-        # audio_url = f"/audio/combined_news_audio.mp3"
-        audio_url = f"{API_BASE_URL}audio/{speech_file_path.name}"
+        audio_url = f"{API_BASE_URL}api/audio/{audio_key}"
         print(audio_url)
 
         # return all_news
@@ -495,41 +502,43 @@ async def fetch_news_global():
 
 
 @app.get("/api/news/", response_model=Any)
-async def fetch_news():
-    try:
+async def fetch_news(
+    request: Request,
+    limit: int = Query(80, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    view: str = Query("full", pattern="^(full|summary)$"),
+    fields: Optional[str] = None
+):
+    selected = requested_fields(view, fields, NEWS_FIELDS, NEWS_SUMMARY_FIELDS)
+
+    async def build():
         # Calculate the date 14 days ago
         seven_days_ago = datetime.utcnow() - timedelta(days=7)
 
-        # Query the database for news articles published within the last 14 days
-        news_articles = news_collection.find({"published_at": {"$gte": seven_days_ago}}).sort("published_at", -1)
-        all_news = []
-        
-        # Convert MongoDB cursor to a list of dictionaries
-        for article in news_articles:
-            news_data = {
-                        "title": article["title"],
-                        "content": article["content"],
-                        "location": {
-                            "city": article["location"]["city"],
-                            "state": "Unknown",
-                            "country": "Unknown",
-                            "coordinates": {
-                                "latitude": 0,
-                                "longitude": 0
-                            }
-                        },
-                        "published_at": article["published_at"],
-                        "source": article["source"],
-                        "id": str(ObjectId())
-                    }
-            all_news.append(news_data)
-        all_news = all_news[:80]
-
-        random.shuffle(all_news)
+        # Query the database for one page of news articles published within the last 14 days, newest first
+        page = Response()
+        query = {"published_at": {"$gte": seven_days_ago}}
+        sort = [("published_at", -1), ("_id", -1)]
+        if selected is None:
+            news_articles = await find_page(news_repo, page, query, sort=sort, limit=limit, after=after)
+            all_news = [news_article(article) for article in news_articles]
+        else:
+            keep = [field for field, _ in sort]
+            all_news = await find_page(
+                news_repo, page, query, sort=sort, limit=limit, after=after,
+                stages=[project_stage(selected, keep=keep)]
+            )
+            strip_kept(all_news, selected, keep)
+            fill_locations(all_news)
+        shuffle_articles(all_news)
+        return {"news": all_news, "audio": ""}, cursor_headers(page)
 
-        # return all_news
-        return {"news": all_news, "audio": ""}
+    try:
+        key = news_cache.make_key("news", limit=limit, after=after, fields=tuple(selected or ()))
+        return await cached_json(request, key, build)
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Fetch news error: {str(e)}")
         raise HTTPException(
@@ -539,51 +548,42 @@ async def fetch_news():
 
 
 @app.get("/api/news/location", response_model=Any)
-async def get_location_news(lat: Optional[float] = None, lon: Optional[float] = None):
+async def get_location_news(
+    request: Request,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    view: str = Query("full", pattern="^(full|summary)$"),
+    fields: Optional[str] = None
+):
+    selected = requested_fields(view, fields, NEWS_FIELDS, NEWS_SUMMARY_FIELDS)
     try:
         city = "New York"  # Default city
         if lat is not None and lon is not None:
-            url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={lat}&lon={lon}&zoom=10"
-            response = requests.get(url, headers={'User-Agent': 'YourApp/1.0'})
-            data = response.json()
-            if 'address' in data:
-                city = data['address'].get('city') or data['address'].get('town') or data['address'].get('village')
-                if city and 'City of' in city:
-                    city = city[8:]
+            city = await reverse_geocoder.get_city(lat, lon) or city
 
-        # Calculate the date 14 days ago
-        seven_days_ago = datetime.utcnow() - timedelta(days=7)
+        async def build():
+            # Calculate the date 14 days ago
+            seven_days_ago = datetime.utcnow() - timedelta(days=7)
 
-        # Query the database for news articles published within the last 14 days and by city
-        news_articles = news_collection.find({"published_at": {"$gte": seven_days_ago}, "location.city": city}).sort("published_at", -1)
-        all_news = []
-        
-        # Convert MongoDB cursor to a list of dictionaries
-        for article in news_articles:
-            news_data = {
-                        "title": article["title"],
-                        "content": article["content"],
-                        "location": {
-                            "city": article["location"]["city"],
-                            "state": "Unknown",
-                            "country": "Unknown",
-                            "coordinates": {
-                                "latitude": 0,
-                                "longitude": 0
-                            }
-                        },
-                        "published_at": article["published_at"],
-                        "source": article["source"],
-                        "id": str(ObjectId())
-                    }
-            all_news.append(news_data)
-
-        # first 40
-        all_news = all_news[:40]
-
-        random.shuffle(all_news)
-
-        return {"news": all_news, "audio": ""}
+            # Query the database for the 40 newest articles of the city published within the last 14 days
+            query = {"published_at": {"$gte": seven_days_ago}, "location.city": city}
+            if selected is None:
+                news_articles = await news_repo.find_many(query, sort=[("published_at", -1)], limit=40)
+                all_news = [news_article(article) for article in news_articles]
+            else:
+                all_news = await news_repo.aggregate([
+                    {"$match": query},
+                    {"$sort": {"published_at": -1}},
+                    {"$limit": 40},
+                    project_stage(selected)
+                ])
+                fill_locations(all_news)
+            shuffle_articles(all_news)
+            return {"news": all_news, "audio": ""}, {}
+
+        # Keyed by the resolved city, so nearby coordinates share one entry
+        key = news_cache.make_key("news_location", city=city, fields=tuple(selected or ()))
+        return await cached_json(request, key, build)
     
     except Exception as e:
         print(f"Fetch news error: {str(e)}")
@@ -595,62 +595,15 @@ async def get_location_news(lat: Optional[float] = None, lon: Optional[float] =
 @app.get("/api/news/fetch", response_model=NewsResponse)
 async def fetch_news_coord(lat: Optional[float] = None, lon: Optional[float] = None):
     try:
-        city = "New York"  # Default city
+        location = None
         if lat is not None and lon is not None:
-            url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={lat}&lon={lon}&zoom=10"
-            response = requests.get(url, headers={'User-Agent': 'YourApp/1.0'})
-            data = response.json()
-            if 'address' in data:
-                city = data['address'].get('city') or data['address'].get('town') or data['address'].get('village')
-                if city and 'City of' in city:
-                    city = city[8:]
+            location = await reverse_geocoder.get_location(lat, lon)
+        location = location or location_for_city("New York")  # Default city
+        city = location["city"]
       
-        headers = get_auth_header(USERNAME, PASSWORD, APP_ID)
-        params = {
-            "published_at": "[NOW-14DAYS/HOUR TO NOW/HOUR]",
-            "language": "(en)",
-            "entities": '{{element:title AND surface_forms:"' + city + '" AND type:("Location", "City")}}',
-            "sort_by": "published_at",
-            "per_page": 80,
-        }
-
-        stories = get_top_stories(params, headers, 80)
-        if not stories:
-            return []
-        deduplicated_stories = remove_duplicates(stories, threshold=0.5)
-        positive_news = []
-        
-        for story in deduplicated_stories:
-            try:   
-                news_data = {
-                    "title": story["title"],
-                    "content": story["body"],
-                    "location": {
-                        "city": city,
-                        "state": "Unknown",
-                        "country": "Unknown",
-                        "coordinates": {
-                            "latitude": lat if lat is not None else 0,
-                            "longitude": lon if lon is not None else 0
-                        }
-                    },
-                    "published_at": datetime.utcnow(),
-                    "source": story["links"]["permalink"],
-                    "id": str(ObjectId())
-                }
-                
-                sentiment = analyze_sentiment(news_data["content"])
-                news_data["sentiment"] = sentiment
-                
-                if sentiment == "positive":
-                    positive_news.append(news_data)
-                    news_collection.insert_one(news_data)
-                    
-            except Exception as story_error:
-                print(f"Error processing story: {story_error}")
-                continue
-         
-        positive_news
+        positive_news = await ingest_city(city, location, n_stories=80)
+        if not positive_news:
+            return {"news": [], "audio": None}
 
         combined_news_content = (
             "Welcome to HappyNest Local Radio, your source for uplifting news and positive updates in your area. "
@@ -665,23 +618,12 @@ async def fetch_news_coord(lat: Optional[float] = None, lon: Optional[float] = N
         combined_news_content += (
             "That concludes today's updates on HappyNest Local Radio. Stay positive, stay informed, and we'll be back soon with more good news!"
         )
-        # Path to save the generated audio file
-        speech_file_path = Path("audio") / f"local_news_{city.replace(' ', '_')}.mp3"
-        os.makedirs("audio", exist_ok=True)
-
-        # Generate speech using OpenAI TTS
-        response = client2.audio.speech.create(
-            model="tts-1",
-            voice="alloy",
-            input=combined_news_content
-        )
-
-        # Save the audio file to the defined path
-        response.stream_to_file(speech_file_path)
+        # Speech is generated with OpenAI TTS and streamed when the client plays the URL
+        audio_key = audio_cache.register(combined_news_content)
 
-        # Return the audio file URL
-        audio_url = f"{API_BASE_URL}audio/{speech_file_path.name}"
-        print(f"Audio file generated: {audio_url}")
+        # Return the audio URL
+        audio_url = f"{API_BASE_URL}api/audio/{audio_key}"
+        print(f"Audio file registered: {audio_url}")
         
         return {"news": positive_news, "audio": audio_url}
         # return positive_news
@@ -703,7 +645,7 @@ async def fetch_news_coord(lat: Optional[float] = None, lon: Optional[float] = N
 @app.get("/api/news/{article_id}", response_model=NewsArticle)
 async def get_news_article(article_id: str):
     article_objectid = str_to_objectid(article_id)
-    news_article = news_collection.find_one({"_id": article_objectid})
+    news_article = await news_repo.find_one({"_id": article_objectid})
     if news_article:
         news_article["id"] = str(news_article["_id"])
         del news_article["_id"]
@@ -714,20 +656,25 @@ async def get_news_article(article_id: str):
 @app.put("/api/news/{article_id}")
 async def update_news(article_id: str, news: NewsArticle):
     article_objectid = str_to_objectid(article_id)
-    update_result = news_collection.update_one(
-        {"_id": article_objectid},
-        {"$set": news.dict(exclude_unset=True)}
-    )
+    try:
+        update_result = await news_repo.update_one(
+            {"_id": article_objectid},
+            {"$set": news.dict(exclude_unset=True)}
+        )
+    except errors.DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A news article with this source already exists")
     if update_result.modified_count == 0:
         raise HTTPException(status_code=404, detail="News article not found")
+    news_cache.invalidate()
     return {"detail": "News article updated successfully"}
 
 @app.delete("/api/news/{article_id}")
 async def delete_news(article_id: str):
     article_objectid = str_to_objectid(article_id)
-    delete_result = news_collection.delete_one({"_id": article_objectid})
+    delete_result = await news_repo.delete_one({"_id": article_objectid})
     if delete_result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="News article not found")
+    news_cache.invalidate()
     return {"detail": "News article deleted successfully"}
 
 # Reply Endpoints
@@ -735,7 +682,7 @@ async def delete_news(article_id: str):
 async def create_reply(deed_id: str, reply: Reply):
     # Convert Good Deed ID to ObjectId and find the good deed
     good_deed_objectid = str_to_objectid(deed_id)
-    good_deed = good_deeds_collection.find_one({"_id": good_deed_objectid})
+    good_deed = await good_deeds_repo.find_one({"_id": good_deed_objectid})
     if not good_deed:
         raise HTTPException(status_code=404, detail="Good deed not found")
 
@@ -743,25 +690,54 @@ async def create_reply(deed_id: str, reply: Reply):
     reply_data = reply.dict()
     reply_data["deed_id"] = deed_id
     reply_data["created_at"] = datetime.now()
-    result = replies_collection.insert_one(reply_data)
+    result = await replies_repo.insert_one(reply_data)
 
     # Update the good deed's replies array with the new reply's ID
-    good_deeds_collection.update_one(
+    await good_deeds_repo.update_one(
         {"_id": good_deed_objectid},
         {"$push": {"replies": str(result.inserted_id)}}
     )
 
     return {"reply_id": str(result.inserted_id)}
 
+@app.post("/api/replies/bulk")
+async def create_replies(items: List[Dict[str, Any]]):
+    # Replies for any number of good deeds; each item names its deed_id
+    valid, results = validate_items(Reply, items)
+    deed_ids = {reply.deed_id for reply in valid.values() if ObjectId.is_valid(reply.deed_id)}
+    existing = await good_deeds_repo.find_many({"_id": {"$in": [ObjectId(deed_id) for deed_id in deed_ids]}}, {"_id": 1})
+    existing = {str(good_deed["_id"]) for good_deed in existing}
+
+    documents = {}
+    for index, reply in valid.items():
+        if reply.deed_id not in existing:
+            results[index] = {"index": index, "status": "invalid", "detail": "Good deed not found"}
+            continue
+        reply_data = reply.dict()
+        reply_data["created_at"] = datetime.now()
+        documents[index] = reply_data
+    created = await insert_items(replies_repo, documents, results)
+
+    # Append the new reply ids to their good deeds, one update per deed
+    reply_ids = {}
+    for index in created:
+        reply_ids.setdefault(documents[index]["deed_id"], []).append(str(documents[index]["_id"]))
+    if reply_ids:
+        await good_deeds_repo.bulk_write([
+            UpdateOne({"_id": ObjectId(deed_id)}, {"$push": {"replies": {"$each": ids}}})
+            for deed_id, ids in reply_ids.items()
+        ], ordered=False)
+    return bulk_response(results)
+
 @app.get("/api/good-deeds/{deed_id}/replies/")
-async def get_all_replies(deed_id: str):
+async def get_all_replies(deed_id: str, response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
     good_deed_objectid = str_to_objectid(deed_id)
-    good_deed = good_deeds_collection.find_one({"_id": good_deed_objectid})
+    good_deed = await good_deeds_repo.find_one({"_id": good_deed_objectid})
     if not good_deed:
         raise HTTPException(status_code=404, detail="Good deed not found")
 
     reply_ids = good_deed.get("replies", [])
-    replies = list(replies_collection.find({"_id": {"$in": [str_to_objectid(rid) for rid in reply_ids]}}))
+    replies = await find_page(replies_repo, response, {"_id": {"$in": [str_to_objectid(rid) for rid in reply_ids]}}, limit=limit, after=after)
     for reply in replies:
         reply["id"] = str(reply["_id"])
         del reply["_id"]
@@ -770,7 +746,7 @@ async def get_all_replies(deed_id: str):
 @app.get("/api/replies/{reply_id}")
 async def get_reply(reply_id: str):
     reply_objectid = str_to_objectid(reply_id)
-    reply = replies_collection.find_one({"_id": reply_objectid})
+    reply = await replies_repo.find_one({"_id": reply_objectid})
     if reply:
         reply["id"] = str(reply["_id"])
         del reply["_id"]
@@ -781,7 +757,7 @@ async def get_reply(reply_id: str):
 @app.put("/api/replies/{reply_id}")
 async def update_reply(reply_id: str, reply: Reply):
     reply_objectid = str_to_objectid(reply_id)
-    update_result = replies_collection.update_one(
+    update_result = await replies_repo.update_one(
         {"_id": reply_objectid},
         {"$set": reply.dict(exclude_unset=True)}
     )
@@ -792,41 +768,22 @@ async def update_reply(reply_id: str, reply: Reply):
 @app.delete("/api/replies/{reply_id}")
 async def delete_reply(reply_id: str):
     reply_objectid = str_to_objectid(reply_id)
-    delete_result = replies_collection.delete_one({"_id": reply_objectid})
+    delete_result = await replies_repo.delete_one({"_id": reply_objectid})
     if delete_result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Reply not found")
     return {"detail": "Reply deleted successfully"}
 
 @app.get("/api/leaderboard/")
-async def get_leaderboard():
-    pipeline = [
-        {
-            "$group": {
-                "_id": "$user_id",  # Groups deeds by user_id
-                "deed_count": {"$sum": 1}  # Counts deeds per user
-            }
-        },
-        {"$sort": {"deed_count": -1}},  # Sort by highest count
-        {"$limit": 10}  # Get top 10
-    ]
-    
-    deed_counts = list(good_deeds_collection.aggregate(pipeline))
-    
-    # Get user details
-    leaders = []
-    for deed_count in deed_counts:
-        user = users_collection.find_one({"_id": deed_count["_id"]})  # Changed to match new format
-        
-        if user:
-            leaders.append({
-                "user_id": deed_count["_id"],
-                "deed_count": deed_count["deed_count"],
-                "name": user["name"],
-                "streak": user["streak"],
-                "mood": user["mood"]
-            })
-    
-    return leaders
+async def get_leaderboard(
+    window: str = Query("all", pattern="^(all|week|month)$"),
+    city: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100)
+):
+    # Served from the counters that good deed writes keep up to date: the
+    # all-time collection directly, weeks, months and cities from daily buckets
+    if window == "all" and not city:
+        return await leaderboard.top_leaders(limit)
+    return await leaderboard.top_leaders_since(limit, None if window == "all" else window, city)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+from pathlib import Path
+import asyncio
+import hashlib
+import json
+import os
+import re
+import uuid
+
+from rate_limit import retry_after_seconds, DEFAULT_PAUSE_SECONDS, OPENAI_MAX_RETRIES
+
+AUDIO_DIR = Path("audio")
+# Total size the audio/ directory may grow to before old broadcasts are removed
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_MB", 200)) * 1024 * 1024
+
+TTS_MODEL = "tts-1"
+TTS_VOICE = "alloy"
+# Size of the pieces relayed to the client while the TTS response streams in
+AUDIO_CHUNK_SIZE = 4096
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class _Synthesis:
+    # One TTS stream on its way into the cache and the chunks received so far
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.task = None
+        self.changed = asyncio.Condition()
+
+
+class AudioCache:
+    # Stores generated radio broadcasts under a hash of the script, voice and
+    # model, so the same script is only ever synthesized once. Scripts are
+    # registered first and synthesized when somebody plays them. When the
+    # directory grows past max_bytes the least recently used files are removed.
+    def __init__(self, directory=AUDIO_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES, limiter=None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        # Optional rate_limit.AdaptiveLimiter that TTS calls go through
+        self.limiter = limiter
+        self.hits = 0
+        self.misses = 0
+        # Syntheses in progress by key, so concurrent first plays share one
+        self._in_flight = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(script, voice=TTS_VOICE, model=TTS_MODEL):
+        return hashlib.sha256(f"{model}\x00{voice}\x00{script}".encode("utf-8")).hexdigest()
+
+    def path_for(self, script, voice=TTS_VOICE, model=TTS_MODEL):
+        return self.directory / f"{self.make_key(script, voice, model)}.mp3"
+
+    def script_path_for(self, key):
+        return self.directory / f"{key}.json"
+
+    def is_valid_key(self, key):
+        return bool(_KEY_RE.match(key))
+
+    def register(self, script, voice=TTS_VOICE, model=TTS_MODEL):
+        # Remember the script so /api/audio/{key} can synthesize it on first play
+        key = self.make_key(script, voice, model)
+        script_path = self.script_path_for(key)
+        if not script_path.exists():
+            partial_path = self.directory / f"{key}.{uuid.uuid4().hex}.part"
+            with open(partial_path, "w", encoding="utf-8") as f:
+                json.dump({"script": script, "voice": voice, "model": model}, f)
+            os.replace(partial_path, script_path)
+        else:
+            self._touch(script_path)
+        return key
+
+    def cached_audio(self, key):
+        # Path of the finished MP3 for a key, or None if it was never generated
+        path = self.directory / f"{key}.mp3"
+        if path.exists():
+            self.hits += 1
+            self._touch(path)
+            return path
+        return None
+
+    def load_script(self, key):
+        try:
+            with open(self.script_path_for(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    async def stream(self, async_client, key, script):
+        # Relay the TTS audio of `key` to the caller as it arrives. Every
+        # caller that asks for the same key while it is being synthesized
+        # shares one TTS stream, and the file only becomes visible in the
+        # cache once the whole stream was written.
+        synthesis = self._in_flight.get(key)
+        if synthesis is None:
+            path = self.directory / f"{key}.mp3"
+            if path.exists():
+                # Finished while this request was on its way
+                self.hits += 1
+                data = await asyncio.to_thread(path.read_bytes)
+                for start in range(0, len(data), AUDIO_CHUNK_SIZE):
+                    yield data[start:start + AUDIO_CHUNK_SIZE]
+                return
+            self.misses += 1
+            synthesis = _Synthesis()
+            self._in_flight[key] = synthesis
+            # Runs on its own so it still completes (and is cached) when the
+            # caller that started it goes away
+            synthesis.task = asyncio.create_task(self._synthesize(async_client, key, script, synthesis))
+
+        sent = 0
+        while True:
+            async with synthesis.changed:
+                await synthesis.changed.wait_for(lambda: len(synthesis.chunks) > sent or synthesis.done)
+                chunks = synthesis.chunks[sent:]
+                done = synthesis.done
+            for chunk in chunks:
+                yield chunk
+            sent += len(chunks)
+            if done and sent >= len(synthesis.chunks):
+                if synthesis.error is not None:
+                    raise RuntimeError("Audio synthesis failed") from synthesis.error
+                return
+
+    async def _synthesize(self, async_client, key, script, synthesis):
+        # A 429 before the first chunk is tried again like post_to_openai
+        # does, up to OPENAI_MAX_RETRIES times; the limiter's pause spaces
+        # the attempts. Once chunks went out to listeners it is too late.
+        path = self.directory / f"{key}.mp3"
+        partial_path = self.directory / f"{key}.{uuid.uuid4().hex}.part"
+        completed = False
+        try:
+            for attempt in range(OPENAI_MAX_RETRIES + 1):
+                status = "error"
+                retry_after = None
+                ticket = None
+                if self.limiter:
+                    ticket = await self.limiter.acquire_async()
+                try:
+                    with open(partial_path, "wb") as f:
+                        async with async_client.audio.speech.with_streaming_response.create(
+                            model=script["model"],
+                            voice=script["voice"],
+                            input=script["script"],
+                            response_format="mp3"
+                        ) as response:
+                            status = "ok"
+                            async for chunk in response.iter_bytes(AUDIO_CHUNK_SIZE):
+                                f.write(chunk)
+                                async with synthesis.changed:
+                                    synthesis.chunks.append(chunk)
+                                    synthesis.changed.notify_all()
+                    os.replace(partial_path, path)
+                    completed = True
+                    synthesis.error = None
+                except Exception as e:
+                    # openai's APIStatusError carries the HTTP status and response
+                    if getattr(e, "status_code", None) == 429:
+                        status = "throttled"
+                        retry_after = retry_after_seconds(getattr(e, "response", None) and e.response.headers)
+                    print(f"Audio synthesis error for {key}: {e}")
+                    synthesis.error = e
+                finally:
+                    if self.limiter:
+                        self.limiter.release(ticket, status, retry_after)
+                if completed or status != "throttled" or synthesis.chunks:
+                    break
+                print(f"OpenAI rate limit hit for audio {key} (attempt {attempt + 1})")
+                if not self.limiter:
+                    await asyncio.sleep(DEFAULT_PAUSE_SECONDS if retry_after is None else retry_after)
+        finally:
+            if not completed:
+                try:
+                    os.remove(partial_path)
+                except OSError:
+                    pass
+            self._in_flight.pop(key, None)
+            async with synthesis.changed:
+                synthesis.done = True
+                synthesis.changed.notify_all()
+        if completed:
+            self.evict(keep=path)
+
+    def _touch(self, path):
+        # The modification time doubles as the last-used time for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        files = []
+        for path in list(self.directory.glob("*.mp3")) + list(self.directory.glob("*.json")):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                continue
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -0,0 +1,240 @@
+from pprint import pprint
+from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import requests
+
+from rate_limit import retry_after_seconds
+
+TOKEN_URL = 'https://api.aylien.com/v1/oauth/token'
+STORIES_URL = 'https://api.aylien.com/v6/news/stories'
+
+# Used when the token response does not say how long the token lives (seconds)
+DEFAULT_TOKEN_TTL = 3600
+# Refresh the token this many seconds before it actually expires
+TOKEN_REFRESH_MARGIN = 60
+
+# Retries (throttling, server and network errors) one story fetch may spend
+AYLIEN_RETRY_BUDGET = int(os.getenv("AYLIEN_RETRY_BUDGET", 6))
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 120
+REQUEST_TIMEOUT_SECONDS = 30
+# How long an interrupted fetch can be resumed from where it stopped
+CURSOR_TTL_SECONDS = int(os.getenv("AYLIEN_CURSOR_TTL_SECONDS", 6 * 3600))
+
+
+class TokenManager:
+    # Caches the Aylien bearer token for one set of credentials and only asks
+    # for a new one when the cached token is about to expire. Concurrent
+    # callers share a lock so the token is refreshed once, not once per caller.
+    def __init__(self, username, password, appid, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.username = username
+        self.password = password
+        self.appid = appid
+        self.refresh_margin = refresh_margin
+        self.hits = 0
+        self.misses = 0
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def _is_valid(self):
+        return self._token is not None and time.monotonic() < self._expires_at - self.refresh_margin
+
+    def get_token(self):
+        if self._is_valid():
+            self.hits += 1
+            return self._token
+        with self._lock:
+            # Another caller may have refreshed the token while we were waiting
+            if self._is_valid():
+                self.hits += 1
+                return self._token
+            self.misses += 1
+            response = requests.post(TOKEN_URL, auth=(self.username, self.password), data={'grant_type': 'password'})
+            response.raise_for_status()
+            token_json = response.json()
+            self._token = token_json['access_token']
+            self._expires_at = time.monotonic() + float(token_json.get('expires_in', DEFAULT_TOKEN_TTL))
+            return self._token
+
+    def get_headers(self):
+        return {'Authorization': 'Bearer {}'.format(self.get_token()), 'AppId': self.appid}
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+            self._expires_at = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+_token_managers = {}
+_token_managers_lock = threading.Lock()
+
+def get_token_manager(username, password, appid):
+    # One process-wide manager per set of credentials
+    key = (username, appid)
+    with _token_managers_lock:
+        if key not in _token_managers:
+            _token_managers[key] = TokenManager(username, password, appid)
+        return _token_managers[key]
+
+def get_auth_header(username, password, appid):
+    # Generate the authorization header for making requests to the Aylien API.
+    return get_token_manager(username, password, appid).get_headers()
+
+def backoff_delay(attempt, retry_after=None):
+    # Exponential backoff with full jitter, but never shorter than Retry-After
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class CursorStore:
+    # Remembers the next_page_cursor of a multi-page fetch, keyed by its query,
+    # so a fetch that was interrupted resumes from the page where it stopped.
+    def __init__(self, repository, ttl_seconds=CURSOR_TTL_SECONDS):
+        self.repository = repository
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def make_key(params):
+        query = {key: value for key, value in params.items() if key != "cursor"}
+        return hashlib.sha256(json.dumps(query, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    async def load(self, key):
+        # (cursor, stories fetched before it) or (None, 0)
+        try:
+            document = await self.repository.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        except Exception as e:
+            print(f"Story cursor read error: {e}")
+            document = None
+        if document is None:
+            return None, 0
+        return document["cursor"], document.get("fetched", 0)
+
+    async def save(self, key, cursor, fetched):
+        try:
+            await self.repository.update_one(
+                {"_id": key},
+                {"$set": {"cursor": cursor, "fetched": fetched, "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl_seconds)}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Story cursor write error: {e}")
+
+    async def clear(self, key):
+        try:
+            await self.repository.delete_one({"_id": key})
+        except Exception as e:
+            print(f"Story cursor delete error: {e}")
+
+
+async def fetch_top_stories(params, headers, n_top_stories=False, cursor_store=None, token_manager=None):
+    # Page through the stories endpoint until n_top_stories are fetched (or
+    # all of them when it is False). Throttling, server and network errors
+    # are retried with jittered backoff until the retry budget is spent;
+    # then, or on any other error, the stories fetched so far are returned.
+    # With a cursor_store the position is saved after every page and a later
+    # call with the same params continues from there. With the token_manager
+    # the headers came from, a 401 (token revoked or expired early) gets a
+    # new token and the page is tried once more.
+    params = dict(params)
+    if 'per_page' in params.keys():
+        if params['per_page'] > n_top_stories and not n_top_stories == False:
+            params['per_page'] = n_top_stories
+
+    key = cursor_store.make_key(params) if cursor_store else None
+    fetched_before = 0
+    if cursor_store:
+        cursor, fetched_before = await cursor_store.load(key)
+        if cursor and (n_top_stories == False or fetched_before < n_top_stories):
+            params['cursor'] = cursor
+            print(f"Resuming story fetch after {fetched_before} stories")
+        else:
+            fetched_before = 0
+
+    fetched_stories = []
+    retries = 0
+    reauthenticated = False
+    finished = False
+    while n_top_stories == False or fetched_before + len(fetched_stories) < n_top_stories:
+        status_code = None
+        retry_after = None
+        try:
+            response = await asyncio.to_thread(
+                requests.get, STORIES_URL, params=params, headers=headers, timeout=REQUEST_TIMEOUT_SECONDS
+            )
+            status_code = response.status_code
+        except requests.RequestException as e:
+            pprint(e)
+            response = None
+
+        if status_code == 200:
+            try:
+                response_json = response.json()
+            except ValueError as e:
+                # A truncated or non-JSON body; keep what was fetched (and the
+                # saved cursor, so a resumed fetch tries this page again)
+                print(f"Aylien returned an unreadable page ({e}), returning {len(fetched_stories)} stories")
+                break
+            stories = response_json.get('stories') or []
+            fetched_stories += stories
+            if stories:
+                print(
+                    'Fetched %d stories. Total story count so far: %d'
+                    % (len(stories), fetched_before + len(fetched_stories))
+                )
+            next_cursor = response_json.get('next_page_cursor')
+            if not stories or not next_cursor:
+                finished = True
+                break
+            params['cursor'] = next_cursor
+            if cursor_store:
+                await cursor_store.save(key, next_cursor, fetched_before + len(fetched_stories))
+            continue
+
+        if status_code == 401 and token_manager and not reauthenticated:
+            print("Aylien token rejected, requesting a new one")
+            reauthenticated = True
+            token_manager.invalidate()
+            headers = await asyncio.to_thread(token_manager.get_headers)
+            continue
+
+        # Throttling, server errors and network failures are worth another try
+        if status_code == 429:
+            retry_after = retry_after_seconds(response.headers)
+        elif status_code is not None and not 500 <= status_code <= 599:
+            # Any other status code is returned for further investigation
+            pprint(response.text)
+            break
+        if retries >= AYLIEN_RETRY_BUDGET:
+            print(f"Aylien retry budget of {AYLIEN_RETRY_BUDGET} spent, returning {len(fetched_stories)} stories")
+            break
+        delay = backoff_delay(retries, retry_after)
+        retries += 1
+        print(f"Aylien request failed ({status_code or 'network error'}), retry {retries}/{AYLIEN_RETRY_BUDGET} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+    else:
+        finished = True
+
+    if cursor_store and finished:
+        await cursor_store.clear(key)
+    return fetched_stories
+
+def get_top_stories(params, headers, n_top_stories=False, token_manager=None):
+    # Blocking version for scripts such as newsapi.py
+    return asyncio.run(fetch_top_stories(params, headers, n_top_stories, token_manager=token_manager))
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+
+
+class ClassificationCache:
+    # Remembers LLM verdicts by a hash of the normalized article text, the model
+    # and the prompt version. Lookups go to a small in-memory LRU first and fall
+    # back to a MongoDB collection that is shared across workers and restarts.
+    def __init__(self, repository, max_entries=10000):
+        self.repository = repository
+        self.max_entries = max_entries
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(text, model, prompt_version):
+        normalized = " ".join(text.split()).lower()
+        return hashlib.sha256(f"{model}\x00{prompt_version}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return self._entries[key]
+        try:
+            document = await self.repository.find_one({"_id": key})
+        except Exception as e:
+            print(f"Classification cache read error: {e}")
+            document = None
+        if document is None:
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        self._remember(key, document["value"])
+        return document["value"]
+
+    async def set(self, key, value, model=None, prompt_version=None):
+        self._remember(key, value)
+        try:
+            await self.repository.update_one(
+                {"_id": key},
+                {"$set": {"value": value, "model": model, "prompt_version": prompt_version, "created_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Classification cache write error: {e}")
+
+    def stats(self):
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0
+        }
@@ -0,0 +1,191 @@
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from typing import Dict, Optional
+import json
+import os
+import re
+import threading
+import requests
+
+from rate_limit import openai_limiter, retry_after_seconds, OPENAI_MAX_RETRIES, OPENAI_TIMEOUT_SECONDS
+
+load_dotenv()
+
+API_ENDPOINT = os.getenv("OPEN_AI_API_ENDPOINT")
+API_KEY = os.getenv("OPEN_AI_API_KEY")
+
+headers = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {API_KEY}"
+}
+
+# Bump CLASSIFIER_PROMPT_VERSION whenever the prompt below changes so cached verdicts are not reused
+# ("3" drops the pre-filter verdicts that version "2" cached as if the LLM had given them)
+CLASSIFIER_MODEL = "gpt-3.5-turbo"
+CLASSIFIER_PROMPT_VERSION = "3"
+
+SENTIMENTS = ("positive", "negative", "neutral")
+
+def post_to_openai(data: Dict) -> requests.Response:
+    # Every call goes through the shared limiter; a 429 slows the limiter
+    # down and the call is tried again, up to OPENAI_MAX_RETRIES times
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        ticket = openai_limiter.acquire()
+        status = "error"
+        retry_after = None
+        try:
+            response = requests.post(API_ENDPOINT, headers=headers, json=data, timeout=OPENAI_TIMEOUT_SECONDS)
+            if response.status_code == 429:
+                status = "throttled"
+                retry_after = retry_after_seconds(response.headers)
+            elif response.status_code == 200:
+                status = "ok"
+        except requests.Timeout:
+            raise HTTPException(status_code=504, detail="OpenAI API timed out")
+        except requests.RequestException as e:
+            raise HTTPException(status_code=502, detail=f"OpenAI API request failed: {e}")
+        finally:
+            # A timeout or network error is reported as "error"
+            openai_limiter.release(ticket, status, retry_after)
+        if status != "throttled":
+            return response
+        print(f"OpenAI rate limit hit (attempt {attempt + 1}), limiter now {openai_limiter.stats()}")
+    return response
+
+def classify_text(text: str) -> Dict:
+    # Ask for the sentiment and the politics verdict in one deterministic call.
+    # The answer is a tiny JSON object, so a handful of tokens is enough.
+    messages = [
+        {"role": "system", "content": "You classify news text. Reply only with a JSON object of the form {\"sentiment\": \"positive\" | \"negative\" | \"neutral\", \"political\": true | false}."},
+        {"role": "user", "content": f"sentiment is 'positive' if the text is happy or positive, 'negative' if it's sad or dangerous, otherwise 'neutral'. political is true if the text is related to politics.\n\n{text}"}
+    ]
+
+    data = {
+        "model": CLASSIFIER_MODEL,
+        "messages": messages,
+        "response_format": {"type": "json_object"},
+        "max_tokens": 20,
+        "temperature": 0,
+        "top_p": 1,
+        "frequency_penalty": 0,
+        "presence_penalty": 0,
+        "stop": None,
+        "stream": False
+    }
+
+    response = post_to_openai(data)
+
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=f"Error from OpenAI API: {response.text}")
+
+    result = response.json()
+    try:
+        verdict = json.loads(result["choices"][0]["message"]["content"])
+    except ValueError:
+        raise HTTPException(status_code=502, detail="OpenAI API returned an invalid classification")
+
+    sentiment = str(verdict.get("sentiment", "")).strip().lower()
+    if sentiment not in SENTIMENTS:
+        sentiment = "neutral"
+    return {"sentiment": sentiment, "political": verdict.get("political") is True}
+
+def is_political(text: str) -> bool:
+    return classify_text(text)["political"]
+
+# Offline pre-filter: a small weighted lexicon that throws out stories that are
+# obviously negative or political before they cost an LLM round trip.
+NEGATIVE_TERMS = {
+    "killed": 2, "kill": 1.5, "killing": 2, "murder": 2, "murdered": 2, "homicide": 2, "shooting": 2,
+    "shot": 1.5, "gunman": 2, "stabbed": 2, "stabbing": 2, "dead": 1.5, "death": 1.5, "died": 1.5,
+    "dies": 1.5, "fatal": 2, "crash": 1.5, "collision": 1, "accident": 1, "injured": 1.5, "victim": 1.5,
+    "victims": 1.5, "arrested": 1.5, "arrest": 1, "charged": 1, "police": 0.5, "suspect": 1.5,
+    "robbery": 2, "assault": 2, "rape": 2, "abuse": 1.5, "fire": 1, "blaze": 1, "explosion": 1.5,
+    "attack": 1.5, "terror": 2, "war": 1.5, "bomb": 2, "lawsuit": 1, "fraud": 1.5, "scam": 1.5,
+    "crime": 1.5, "prison": 1, "jail": 1, "sentenced": 1.5, "missing": 1, "flood": 1, "earthquake": 1.5,
+    "layoffs": 1.5, "bankruptcy": 1.5, "overdose": 2, "hostage": 2, "riot": 1.5, "protest": 0.5
+}
+POLITICAL_TERMS = {
+    "election": 2, "elections": 2, "vote": 1, "voters": 1.5, "ballot": 1.5, "campaign": 1, "senate": 2,
+    "senator": 2, "congress": 2, "congressman": 2, "congresswoman": 2, "parliament": 2, "governor": 1.5,
+    "president": 1, "presidential": 2, "democrat": 2, "democrats": 2, "republican": 2, "republicans": 2,
+    "gop": 2, "minister": 1.5, "legislation": 1.5, "lawmakers": 2, "policy": 0.5, "trump": 2, "biden": 2,
+    "harris": 1, "mayor": 0.5, "political": 2, "politics": 2, "partisan": 2
+}
+POSITIVE_TERMS = {
+    "celebrate": 1, "celebrates": 1, "celebration": 1, "donate": 1, "donated": 1, "donation": 1,
+    "volunteer": 1, "volunteers": 1, "kindness": 1.5, "charity": 1, "rescued": 1, "rescue": 0.5,
+    "award": 1, "wins": 1, "winner": 1, "joy": 1, "happy": 1, "hope": 0.5, "inspiring": 1.5,
+    "heartwarming": 2, "community": 0.5, "helps": 1, "help": 0.5, "reunited": 1.5, "festival": 1
+}
+
+# Minimum confidence (0-1) for the pre-filter to decide without the LLM
+PREFILTER_THRESHOLD = float(os.getenv("PREFILTER_THRESHOLD", 0.8))
+# "on" skips the LLM for confident verdicts, "shadow" always asks the LLM and
+# only records how often the pre-filter agreed with it, "off" disables it.
+# Stays "shadow" until the lexicon has been tuned against the LLM verdicts.
+PREFILTER_MODE = os.getenv("PREFILTER_MODE", "shadow")
+
+_WORD_RE = re.compile(r"[a-z]+")
+_prefilter_counts = {"decided": 0, "passed": 0, "agreed": 0, "disagreed": 0}
+_prefilter_lock = threading.Lock()
+
+def _lexicon_score(words, lexicon):
+    return sum(lexicon.get(word, 0) for word in words)
+
+def prefilter_sentiment(text: str, threshold: float = PREFILTER_THRESHOLD) -> Optional[str]:
+    # Returns "negative" or "neutral" (political) when the lexicon is confident,
+    # or None when the story is borderline and has to go to the LLM.
+    words = _WORD_RE.findall(text.lower())
+    positive = _lexicon_score(words, POSITIVE_TERMS)
+    negative = _lexicon_score(words, NEGATIVE_TERMS)
+    political = _lexicon_score(words, POLITICAL_TERMS)
+    # The +1 keeps a single strong word from being enough on its own
+    if political / (political + positive + 1) >= threshold:
+        return "neutral"
+    if negative / (negative + positive + 1) >= threshold:
+        return "negative"
+    return None
+
+def _count_prefilter(key):
+    with _prefilter_lock:
+        _prefilter_counts[key] += 1
+
+def prefilter_stats() -> Dict:
+    with _prefilter_lock:
+        stats = dict(_prefilter_counts)
+    compared = stats["agreed"] + stats["disagreed"]
+    stats["mode"] = PREFILTER_MODE
+    stats["agreement_rate"] = stats["agreed"] / compared if compared else 0.0
+    return stats
+
+def llm_sentiment(text: str) -> str:
+    # Political stories are never shown as happy news
+    verdict = classify_text(text)
+    if verdict["sentiment"] == "positive" and verdict["political"]:
+        return "neutral"
+    return verdict["sentiment"]
+
+def prefilter_decides(text: str) -> Optional[str]:
+    # The verdict to use without asking the LLM, or None when the LLM has to
+    # be asked (always, unless PREFILTER_MODE is "on")
+    if PREFILTER_MODE != "on":
+        return None
+    guess = prefilter_sentiment(text)
+    _count_prefilter("decided" if guess is not None else "passed")
+    return guess
+
+def record_shadow(text: str, sentiment: str):
+    # In shadow mode, count whether the pre-filter agreed with the LLM verdict
+    if PREFILTER_MODE != "shadow":
+        return
+    guess = prefilter_sentiment(text)
+    if guess is not None:
+        _count_prefilter("agreed" if guess == sentiment else "disagreed")
+
+def analyze_sentiment(text: str) -> str:
+    guess = prefilter_decides(text)
+    if guess is not None:
+        return guess
+    sentiment = llm_sentiment(text)
+    record_shadow(text, sentiment)
+    return sentiment
@@ -0,0 +1,128 @@
+from starlette.datastructures import Headers, MutableHeaders
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional; without it only gzip is offered
+    brotli = None
+
+# Responses smaller than this are sent as they are
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 1024))
+GZIP_LEVEL = 6
+# Brotli's fast end still beats gzip on JSON at a similar cost per request
+BROTLI_QUALITY = 5
+
+# Formats that are compressed already, and event streams that must not be buffered
+SKIP_CONTENT_TYPES = ("audio/", "image/", "video/", "application/zip", "application/gzip", "text/event-stream")
+
+
+def choose_encoding(accept_encoding, available):
+    # The encoding from `available` with the highest q-value in the
+    # Accept-Encoding header; ties go to the earlier one in `available`
+    preferences = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        preferences[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = preferences.get(encoding, preferences.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def make_compressor(encoding):
+    # (compress, finish) pair. compress flushes after every chunk so streamed
+    # responses still reach the client piece by piece.
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return (lambda data: compressor.process(data) + compressor.flush()), compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+
+
+class CompressionMiddleware:
+    # Compresses responses with brotli or gzip, whichever the client prefers,
+    # once they are at least minimum_size bytes (streamed responses always).
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = (("br",) if brotli else ()) + ("gzip",)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        state = {"start": None, "passthrough": False, "compress": None, "finish": None}
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                state["start"] = message
+                state["passthrough"] = (
+                    "content-encoding" in headers
+                    or message["status"] in (204, 206, 304)
+                    or headers.get("content-type", "").startswith(SKIP_CONTENT_TYPES)
+                )
+                if message["status"] == 304 and encoding is not None and "content-encoding" not in headers:
+                    # A 304 stands in for the 200 the client would get now:
+                    # same Vary and the same weakened ETag as the compressed body
+                    headers = MutableHeaders(raw=message["headers"])
+                    headers.add_vary_header("Accept-Encoding")
+                    etag = headers.get("etag")
+                    if etag and not etag.startswith("W/"):
+                        headers["ETag"] = "W/" + etag
+                if state["passthrough"]:
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if state["compress"] is None:
+                # The first chunk decides: small complete bodies go out as they are
+                start = state["start"]
+                headers = MutableHeaders(raw=start["headers"])
+                headers.add_vary_header("Accept-Encoding")
+                if encoding is None or (not more_body and len(body) < self.minimum_size):
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+                state["compress"], state["finish"] = make_compressor(encoding)
+                data = state["compress"](body)
+                if not more_body:
+                    data += state["finish"]()
+                    headers["Content-Length"] = str(len(data))
+                elif "content-length" in headers:
+                    del headers["Content-Length"]
+                headers["Content-Encoding"] = encoding
+                # The compressed bytes differ from what a strong ETag promises
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                await send(start)
+            else:
+                data = state["compress"](body)
+                if not more_body:
+                    data += state["finish"]()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,120 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import errors
+from dotenv import load_dotenv
+from pagination import encode_cursor, decode_cursor, keyset_filter
+import os
+
+# Load environment variables
+load_dotenv()
+
+# MongoDB connection setup
+MONGODB_URI = os.getenv('MONGODB_URI')
+
+client = AsyncIOMotorClient(MONGODB_URI)
+db = client.get_database("HappyNest")  # HappyNest database
+
+
+class Repository:
+    # Async data access for a single MongoDB collection. Every call awaits the
+    # motor driver, so a slow query never blocks the event loop.
+    def __init__(self, collection):
+        self.collection = collection
+
+    @property
+    def name(self):
+        return self.collection.name
+
+    async def find_one(self, query, projection=None):
+        return await self.collection.find_one(query, projection)
+
+    async def find_many(self, query=None, projection=None, sort=None, limit=0, session=None):
+        cursor = self.collection.find(query or {}, projection, session=session)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(length=None)
+
+    async def find_page(self, query=None, projection=None, sort=None, limit=100, after=None):
+        # One page of results in `sort` order (which must end with _id so it is
+        # unique), plus the cursor for the next page or None on the last page.
+        # `after` is a cursor from a previous call; a bad one raises ValueError.
+        sort = sort or [("_id", 1)]
+        query = query or {}
+        if after:
+            query = {"$and": [query, keyset_filter(sort, decode_cursor(after))]}
+        cursor = self.collection.find(query, projection).sort(sort).limit(limit + 1)
+        documents = await cursor.to_list(length=None)
+        if len(documents) <= limit:
+            return documents, None
+        documents = documents[:limit]
+        return documents, encode_cursor([documents[-1].get(field) for field, _ in sort])
+
+    async def aggregate_page(self, stages, query=None, sort=None, limit=100, after=None):
+        # Like find_page, but runs `stages` on the page inside the same
+        # aggregation. The stages must keep the sort fields so the next cursor
+        # can be built from the last document.
+        sort = sort or [("_id", 1)]
+        query = query or {}
+        if after:
+            query = {"$and": [query, keyset_filter(sort, decode_cursor(after))]}
+        pipeline = [{"$match": query}, {"$sort": dict(sort)}, {"$limit": limit + 1}] + stages
+        documents = await self.aggregate(pipeline)
+        if len(documents) <= limit:
+            return documents, None
+        documents = documents[:limit]
+        return documents, encode_cursor([documents[-1].get(field) for field, _ in sort])
+
+    async def insert_one(self, document):
+        return await self.collection.insert_one(document)
+
+    async def insert_many(self, documents, ordered=True):
+        return await self.collection.insert_many(documents, ordered=ordered)
+
+    async def update_one(self, query, update, upsert=False):
+        return await self.collection.update_one(query, update, upsert=upsert)
+
+    async def delete_one(self, query):
+        return await self.collection.delete_one(query)
+
+    async def find_one_and_delete(self, query, projection=None):
+        return await self.collection.find_one_and_delete(query, projection)
+
+    async def find_one_and_update(self, query, update, projection=None):
+        # The document as it was before the update
+        return await self.collection.find_one_and_update(query, update, projection)
+
+    async def bulk_write(self, operations, ordered=True):
+        return await self.collection.bulk_write(operations, ordered=ordered)
+
+    async def aggregate(self, pipeline, session=None):
+        return await self.collection.aggregate(pipeline, session=session).to_list(length=None)
+
+
+users_repo = Repository(db.get_collection("users"))
+news_repo = Repository(db.get_collection("news"))
+good_deeds_repo = Repository(db.get_collection("good_deeds"))
+replies_repo = Repository(db.get_collection("replies"))
+classifications_repo = Repository(db.get_collection("classifications"))
+geocodes_repo = Repository(db.get_collection("geocodes"))
+leaderboard_repo = Repository(db.get_collection("leaderboard"))
+leaderboard_daily_repo = Repository(db.get_collection("leaderboard_daily"))
+story_cursors_repo = Repository(db.get_collection("story_cursors"))
+
+
+def snapshot_session():
+    # Reads made with this session all see the same point in time
+    # (replica sets and MongoDB 5.0+). Use as `async with await snapshot_session()`.
+    return client.start_session(snapshot=True)
+
+
+async def check_connection():
+    # Force the client to connect to the server
+    try:
+        await client.server_info()
+        print("Databases available:")
+        print(await client.list_database_names())
+        print("Connected successfully to the 'HappyNest' database!")
+    except errors.ConnectionFailure as e:
+        print(f"Could not connect to MongoDB: {e}")
+        raise
@@ -0,0 +1,83 @@
+from difflib import SequenceMatcher
+import zlib
+
+import numpy as np
+
+# MinHash-LSH settings. SequenceMatcher compares characters, so titles are
+# hashed as sets of SHINGLE_SIZE-character pieces. With one hash per band, two
+# titles become candidates when any of the NUM_BANDS hashes match, which
+# happens with probability 1 - (1 - s) ** NUM_BANDS for shingle Jaccard
+# similarity s. Titles with a ratio just above 0.5 can share as few as 5% of
+# their shingles, where that is still above 0.998.
+SHINGLE_SIZE = 3
+NUM_BANDS = 128
+
+_rng = np.random.default_rng(42)
+# Multiply-shift hashing: (a * h + b) mod 2**64, top 32 bits, with odd a
+_HASH_A = _rng.integers(1, 1 << 63, size=NUM_BANDS, dtype=np.uint64) | np.uint64(1)
+_HASH_B = _rng.integers(0, 1 << 63, size=NUM_BANDS, dtype=np.uint64)
+
+# Function to calculate similarity
+def similar(a, b):
+    return SequenceMatcher(None, a, b).ratio()
+
+def _shingles(title):
+    title = " ".join(title.lower().split())
+    if len(title) <= SHINGLE_SIZE:
+        return {title}
+    return {title[i:i + SHINGLE_SIZE] for i in range(len(title) - SHINGLE_SIZE + 1)}
+
+def _band_keys(shingles):
+    hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64)
+    signature = ((_HASH_A[:, None] * hashes[None, :] + _HASH_B[:, None]) >> np.uint64(32)).min(axis=1)
+    return list(enumerate(signature.tolist()))
+
+def _remove_duplicates_exact(stories, threshold):
+    # Original pairwise scan against every kept title, O(n^2)
+    unique_stories = []
+    seen_titles = []
+    for story in stories:
+        title = story['title']
+        if not any(similar(title, seen_title) > threshold for seen_title in seen_titles):
+            unique_stories.append(story)
+            seen_titles.append(title)
+    return unique_stories
+
+# Function to remove duplicates based on a given threshold
+def remove_duplicates(stories, threshold=0.5, exact=False):
+    # A story is dropped when its title is more than `threshold` similar
+    # (SequenceMatcher ratio) to an earlier kept title. Instead of comparing with
+    # every kept title, a MinHash-LSH index over title shingles finds the kept
+    # titles that could be duplicates and only those are compared.
+    # exact=True runs the original all-pairs scan, e.g. to compare results.
+    if exact:
+        return _remove_duplicates_exact(stories, threshold)
+
+    unique_stories = []
+    # One matcher per kept title: SequenceMatcher caches what it learns about
+    # its second sequence, and similar(title, kept) puts the kept title there
+    matchers = []
+    buckets = {}
+    for story in stories:
+        title = story['title']
+        keys = _band_keys(_shingles(title))
+
+        candidates = set()
+        for key in keys:
+            candidates.update(buckets.get(key, ()))
+        duplicate = False
+        for index in sorted(candidates):
+            matcher = matchers[index]
+            matcher.set_seq1(title)
+            # The quick ratios are upper bounds of ratio() and much cheaper
+            if matcher.real_quick_ratio() > threshold and matcher.quick_ratio() > threshold and matcher.ratio() > threshold:
+                duplicate = True
+                break
+        if duplicate:
+            continue
+
+        for key in keys:
+            buckets.setdefault(key, []).append(len(unique_stories))
+        unique_stories.append(story)
+        matchers.append(SequenceMatcher(None, "", title))
+    return unique_stories
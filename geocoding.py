@@ -0,0 +1,270 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from scipy.spatial import cKDTree
+import numpy as np
+import asyncio
+import csv
+import math
+import os
+import time
+import requests
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/reverse"
+NOMINATIM_HEADERS = {'User-Agent': 'HappyNest/1.0'}
+# Nominatim's usage policy allows at most one request per second
+NOMINATIM_MIN_INTERVAL = 1.0
+# Requests are made one at a time, so a stalled one must not hold up the rest for long
+NOMINATIM_TIMEOUT_SECONDS = float(os.getenv("NOMINATIM_TIMEOUT_SECONDS", 5))
+
+# Geohash precision 5 is a ~5km x 5km cell, fine enough to tell cities apart
+GEOHASH_PRECISION = int(os.getenv("GEOHASH_PRECISION", 5))
+GEOCODE_TTL = timedelta(days=int(os.getenv("GEOCODE_TTL_DAYS", 30)))
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", 10000))
+
+# Bundled city list (name,state,country,latitude,longitude); a bigger CSV with
+# the same columns can be used instead through GAZETTEER_PATH
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cities.csv"))
+# Points further than this from every gazetteer city fall back to Nominatim.
+# The bundled list only has big cities, so the radius stays small enough that
+# a neighbouring city (Oakland, Pasadena, Gary) is not taken for the big one;
+# raise it together with a denser GAZETTEER_PATH.
+GAZETTEER_MAX_DISTANCE_KM = float(os.getenv("GAZETTEER_MAX_DISTANCE_KM", 10))
+EARTH_RADIUS_KM = 6371.0
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def encode_geohash(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        value_range, value = (lon_range, lon) if even else (lat_range, lat)
+        middle = (value_range[0] + value_range[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            value_range[0] = middle
+        else:
+            bits = bits << 1
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(geohash)
+
+def city_from_nominatim(lat, lon):
+    # Blocking Nominatim lookup, returns None when the point has no city
+    params = {"format": "json", "lat": lat, "lon": lon, "zoom": 10}
+    response = requests.get(NOMINATIM_URL, params=params, headers=NOMINATIM_HEADERS, timeout=NOMINATIM_TIMEOUT_SECONDS)
+    data = response.json()
+    if 'address' in data:
+        city = data['address'].get('city') or data['address'].get('town') or data['address'].get('village')
+        if city and 'City of' in city:
+            city = city[8:]
+        return city
+    return None
+
+
+def _to_unit_vectors(coordinates):
+    # (lat, lon) degrees -> points on the unit sphere, so that straight-line
+    # distance in the KD-tree orders cities the same way as great-circle distance
+    radians = np.radians(coordinates)
+    lat, lon = radians[:, 0], radians[:, 1]
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+def _chord_to_km(chord):
+    return 2 * math.asin(min(chord / 2, 1.0)) * EARTH_RADIUS_KM
+
+
+class Gazetteer:
+    # Offline nearest-city lookup over a local city list held in a KD-tree
+    def __init__(self, path=GAZETTEER_PATH):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        self.names = [row["name"] for row in rows]
+        self.states = [row["state"] for row in rows]
+        self.countries = [row["country"] for row in rows]
+        self.coordinates = np.array([[float(row["latitude"]), float(row["longitude"])] for row in rows], dtype=np.float32)
+        self.tree = cKDTree(_to_unit_vectors(self.coordinates.astype(np.float64)))
+        self._by_name = {}
+        for index, name in enumerate(self.names):
+            self._by_name.setdefault(name.lower(), index)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _location(self, index):
+        return {
+            "city": self.names[index],
+            "state": self.states[index],
+            "country": self.countries[index],
+            "coordinates": {
+                "latitude": round(float(self.coordinates[index][0]), 5),
+                "longitude": round(float(self.coordinates[index][1]), 5)
+            }
+        }
+
+    def nearest(self, lat, lon, max_distance_km=GAZETTEER_MAX_DISTANCE_KM):
+        distance, index = self.tree.query(_to_unit_vectors(np.array([[lat, lon]], dtype=np.float64))[0])
+        if _chord_to_km(distance) > max_distance_km:
+            return None
+        return self._location(int(index))
+
+    def find_by_name(self, name):
+        index = self._by_name.get(name.lower()) if name else None
+        return self._location(index) if index is not None else None
+
+
+@lru_cache(maxsize=None)
+def get_gazetteer():
+    return Gazetteer()
+
+def _unknown_location(city, lat=0, lon=0):
+    return {
+        "city": city,
+        "state": "Unknown",
+        "country": "Unknown",
+        "coordinates": {
+            "latitude": lat,
+            "longitude": lon
+        }
+    }
+
+def location_for_city(city):
+    # Full location for a city name, with "Unknown" fields when it is not in the gazetteer
+    return get_gazetteer().find_by_name(city) or _unknown_location(city)
+
+
+class ReverseGeocoder:
+    # Resolves coordinates to a city. The bundled gazetteer answers most lookups
+    # without any network hop. Everything else is cached per geohash cell in
+    # an in-memory LRU with a TTL, optionally backed by a MongoDB collection.
+    # Misses go to Nominatim one at a time, no faster than once per second, and
+    # concurrent misses for the same cell share a single request.
+    def __init__(self, repository=None, ttl=GEOCODE_TTL, max_entries=GEOCODE_CACHE_SIZE, precision=GEOHASH_PRECISION):
+        self.repository = repository
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self.gazetteer_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._request_lock = asyncio.Lock()
+        self._last_request = 0.0
+
+    def _get_cached(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        city, expires_at = entry
+        if expires_at <= datetime.utcnow():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return city
+
+    def _remember(self, key, city, expires_at):
+        self._entries[key] = (city, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _load(self, key):
+        if self.repository is None:
+            return None
+        try:
+            document = await self.repository.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        except Exception as e:
+            print(f"Geocode cache read error: {e}")
+            return None
+        if document is None:
+            return None
+        self._remember(key, document["city"], document["expires_at"])
+        return document["city"]
+
+    async def _store(self, key, city):
+        expires_at = datetime.utcnow() + self.ttl
+        self._remember(key, city, expires_at)
+        if self.repository is None:
+            return
+        try:
+            await self.repository.update_one(
+                {"_id": key},
+                {"$set": {"city": city, "expires_at": expires_at}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Geocode cache write error: {e}")
+
+    async def _request(self, lat, lon):
+        async with self._request_lock:
+            wait = self._last_request + NOMINATIM_MIN_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await asyncio.to_thread(city_from_nominatim, lat, lon)
+            finally:
+                self._last_request = time.monotonic()
+
+    async def _resolve(self, key, lat, lon):
+        city = await self._load(key)
+        if city is not None:
+            self.hits += 1
+            return city
+        self.misses += 1
+        try:
+            city = await self._request(lat, lon)
+        except (requests.RequestException, ValueError) as e:
+            # Not cached, so the cell is looked up again next time; callers
+            # fall back to their default city
+            print(f"Nominatim lookup failed for {key}: {e}")
+            return None
+        if city:
+            await self._store(key, city)
+        return city
+
+    async def get_location(self, lat, lon):
+        # City, state, country and city coordinates for a point, or None if unknown
+        location = get_gazetteer().nearest(lat, lon)
+        if location is not None:
+            self.gazetteer_hits += 1
+            return location
+        city = await self._get_remote_city(lat, lon)
+        return _unknown_location(city, lat, lon) if city else None
+
+    async def get_city(self, lat, lon):
+        location = await self.get_location(lat, lon)
+        return location["city"] if location else None
+
+    async def _get_remote_city(self, lat, lon):
+        key = encode_geohash(lat, lon, self.precision)
+        city = self._get_cached(key)
+        if city is not None:
+            self.hits += 1
+            return city
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._resolve(key, lat, lon))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "gazetteer_hits": self.gazetteer_hits,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries)
+        }
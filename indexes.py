@@ -0,0 +1,50 @@
+from pymongo import ASCENDING, DESCENDING, errors
+
+# Indexes for the hot queries, one entry per index. Applying them is
+# idempotent: MongoDB skips an index that already exists with the same spec.
+INDEX_SPECS = [
+    # /api/news/location: recent news for one city, newest first
+    {"collection": "news", "keys": [("location.city", ASCENDING), ("published_at", DESCENDING)], "name": "city_published_at"},
+    # /api/news/: recent news everywhere, newest first
+    {"collection": "news", "keys": [("published_at", DESCENDING)], "name": "published_at"},
+    # One document per story; ingestion upserts on it. Articles without a
+    # source are left out, so any number of them may exist. Creating it fails
+    # while duplicates are stored, so remove those first (sample_db.py option 17).
+    {"collection": "news", "keys": [("source", ASCENDING)], "name": "source", "unique": True,
+     "partialFilterExpression": {"source": {"$type": "string"}}},
+    # Leaderboard $group and per-user deed lookups
+    {"collection": "good_deeds", "keys": [("user_id", ASCENDING)], "name": "user_id"},
+    # Replies of one good deed
+    {"collection": "replies", "keys": [("deed_id", ASCENDING)], "name": "deed_id"},
+    # /api/leaderboard/: top users by deed count
+    {"collection": "leaderboard", "keys": [("deed_count", DESCENDING)], "name": "deed_count"},
+    # One counter per user, day and city; the upsert in leaderboard.record_deed relies on it
+    {"collection": "leaderboard_daily", "keys": [("user_id", ASCENDING), ("day", ASCENDING), ("city", ASCENDING)], "name": "user_day_city", "unique": True},
+    # Weekly/monthly leaderboards, worldwide and per city
+    {"collection": "leaderboard_daily", "keys": [("day", DESCENDING)], "name": "day"},
+    {"collection": "leaderboard_daily", "keys": [("city", ASCENDING), ("day", DESCENDING)], "name": "city_day"},
+    # Let MongoDB drop expired reverse-geocoding cache entries
+    {"collection": "geocodes", "keys": [("expires_at", ASCENDING)], "name": "expires_at_ttl", "expireAfterSeconds": 0},
+    # Let MongoDB drop expired positions of interrupted story fetches
+    {"collection": "story_cursors", "keys": [("expires_at", ASCENDING)], "name": "expires_at_ttl", "expireAfterSeconds": 0},
+]
+
+def _index_options(spec):
+    return {key: value for key, value in spec.items() if key not in ("collection", "keys")}
+
+async def ensure_indexes(db):
+    # Async version for the API (motor database)
+    for spec in INDEX_SPECS:
+        try:
+            await db.get_collection(spec["collection"]).create_index(spec["keys"], **_index_options(spec))
+        except errors.PyMongoError as e:
+            print(f"Could not create index {spec['name']} on {spec['collection']}: {e}")
+
+def ensure_indexes_sync(db):
+    # Blocking version for scripts such as sample_db.py (pymongo database)
+    for spec in INDEX_SPECS:
+        try:
+            db.get_collection(spec["collection"]).create_index(spec["keys"], **_index_options(spec))
+            print(f"Index {spec['name']} on {spec['collection']} is in place.")
+        except errors.PyMongoError as e:
+            print(f"Could not create index {spec['name']} on {spec['collection']}: {e}")
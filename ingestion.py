@@ -0,0 +1,187 @@
+from bson.objectid import ObjectId
+from pymongo import UpdateOne, errors
+from dotenv import load_dotenv
+from typing import Optional, Dict, List
+from datetime import datetime
+import asyncio
+import os
+import sys
+
+from database import db, news_repo, classifications_repo, story_cursors_repo, check_connection
+from indexes import ensure_indexes
+from classification_cache import ClassificationCache
+from classifier import (
+    llm_sentiment, prefilter_decides, record_shadow, prefilter_stats, CLASSIFIER_MODEL, CLASSIFIER_PROMPT_VERSION
+)
+from aylien import get_token_manager, fetch_top_stories, CursorStore
+from dedup import remove_duplicates
+from rate_limit import openai_limiter
+from geocoding import location_for_city
+from response_cache import news_cache
+
+# Load environment variables
+load_dotenv()
+
+USERNAME = os.getenv("AYLIEN_USERNAME")
+PASSWORD = os.getenv("AYLIEN_PASSWORD")
+APP_ID = os.getenv("AYLIEN_APP_ID")
+
+GLOBAL_CITIES = [
+    "New York", "Los Angeles", "Chicago", "San Francisco", "Miami", "Houston", "Boston", "Seattle",
+    "London", "Paris", "Berlin", "Rome", "Madrid", "Barcelona", "Amsterdam", "Vienna", "Zurich",
+    "Tokyo", "Osaka", "Kyoto", "Seoul", "Beijing", "Shanghai", "Hong Kong", "Singapore",
+    "Sydney", "Melbourne", "Brisbane", "Auckland", "Toronto", "Vancouver", "Montreal", "Ottawa",
+    "Dubai", "Abu Dhabi", "Cairo", "Cape Town", "Lagos", "Nairobi", "Mumbai", "Delhi", "Bangalore",
+    "Mexico City", "Buenos Aires", "Rio de Janeiro", "Sao Paulo", "Lima", "Bogota", "Caracas",
+    "Jakarta", "Manila", "Kuala Lumpur", "Bangkok", "Ho Chi Minh City", "Istanbul"
+]
+
+# Worker settings: comma separated cities, minutes between runs and stories per city
+INGEST_CITIES = [city.strip() for city in os.getenv("INGEST_CITIES", ",".join(GLOBAL_CITIES)).split(",") if city.strip()]
+INGEST_INTERVAL_MINUTES = float(os.getenv("INGEST_INTERVAL_MINUTES", 60))
+INGEST_STORIES = int(os.getenv("INGEST_STORIES", 80))
+
+# Maximum number of stories classified at the same time
+CLASSIFY_CONCURRENCY = int(os.getenv("CLASSIFY_CONCURRENCY", 8))
+
+classification_cache = ClassificationCache(classifications_repo)
+story_cursors = CursorStore(story_cursors_repo)
+
+async def classify_stories(texts: List[str], concurrency: int = CLASSIFY_CONCURRENCY) -> List[Optional[str]]:
+    # Classify all texts in parallel, at most `concurrency` LLM calls at a time,
+    # and return the sentiments in the same order as the texts. The pre-filter
+    # may decide on its own (PREFILTER_MODE=on); otherwise the LLM verdict comes
+    # from the classification cache or a new call. Only LLM verdicts are cached,
+    # so changing the pre-filter never leaves its verdicts behind.
+    # A text that fails to classify gets None so the caller can skip it.
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def classify(text):
+        guess = prefilter_decides(text)
+        if guess is not None:
+            return guess
+        key = classification_cache.make_key(text, CLASSIFIER_MODEL, CLASSIFIER_PROMPT_VERSION)
+        sentiment = await classification_cache.get(key)
+        if sentiment is None:
+            async with semaphore:
+                try:
+                    sentiment = await asyncio.to_thread(llm_sentiment, text)
+                except Exception as story_error:
+                    print(f"Error processing story: {story_error}")
+                    return None
+            await classification_cache.set(key, sentiment, CLASSIFIER_MODEL, CLASSIFIER_PROMPT_VERSION)
+        record_shadow(text, sentiment)
+        return sentiment
+
+    sentiments = await asyncio.gather(*(classify(text) for text in texts))
+    print(f"Classification cache: {classification_cache.stats()}")
+    print(f"Sentiment pre-filter: {prefilter_stats()}")
+    print(f"OpenAI limiter: {openai_limiter.stats()}")
+    return sentiments
+
+async def _fetch_stories(city: str, n_stories: int, resume: bool = False) -> List[Dict]:
+    token_manager = get_token_manager(USERNAME, PASSWORD, APP_ID)
+    headers = await asyncio.to_thread(token_manager.get_headers)
+    params = {
+        "published_at": "[NOW-14DAYS/HOUR TO NOW/HOUR]",
+        "language": "(en)",
+        "entities": '{{element:title AND surface_forms:"' + city + '" AND type:("Location", "City")}}',
+        "sort_by": "published_at",
+        "per_page": n_stories,
+    }
+    stories = await fetch_top_stories(params, headers, n_stories, story_cursors if resume else None, token_manager)
+    return await asyncio.to_thread(remove_duplicates, stories, threshold=0.5) if stories else []
+
+async def fetch_candidate_news(city: str, location: Optional[Dict] = None, n_stories: int = INGEST_STORIES, resume: bool = False) -> List[Dict]:
+    # Deduplicated Aylien stories for a city, shaped like our news documents.
+    # With resume, a fetch that was interrupted continues where it stopped.
+    location = location or location_for_city(city)
+    stories = await _fetch_stories(city, n_stories, resume)
+    candidate_news = []
+    for story in stories:
+        try:
+            news_data = {
+                "title": story["title"],
+                "content": story["body"],
+                "location": dict(location),
+                "published_at": datetime.utcnow(),
+                "source": story["links"]["permalink"],
+                "id": str(ObjectId())
+            }
+            candidate_news.append(news_data)
+        except Exception as story_error:
+            print(f"Error processing story: {story_error}")
+            continue
+    return candidate_news
+
+async def keep_positive(candidate_news: List[Dict]) -> List[Dict]:
+    sentiments = await classify_stories([news_data["content"] for news_data in candidate_news])
+    positive_news = []
+    for news_data, sentiment in zip(candidate_news, sentiments):
+        news_data["sentiment"] = sentiment
+        if sentiment == "positive":
+            positive_news.append(news_data)
+    return positive_news
+
+async def known_news(sources: List[str]) -> Dict[str, Dict]:
+    # Stored articles for these permalinks, in one query on the source index
+    if not sources:
+        return {}
+    # $type matches the partial unique index on source
+    articles = await news_repo.find_many({"source": {"$in": sources, "$type": "string"}})
+    return {article["source"]: article for article in articles}
+
+async def store_news(news: List[Dict]):
+    # One unordered bulk upsert keyed by permalink: stories stored in the
+    # meantime (e.g. by a concurrent run) are left as they are
+    if not news:
+        return
+    operations = [UpdateOne({"source": news_data["source"]}, {"$setOnInsert": news_data}, upsert=True) for news_data in news]
+    try:
+        result = await news_repo.bulk_write(operations, ordered=False)
+        print(f"Stored {result.upserted_count} new stories")
+    except errors.BulkWriteError as e:
+        # Duplicate key errors from racing upserts; the other writes went through
+        print(f"Bulk news write finished with errors: {e.details.get('writeErrors', [])[:3]}")
+    news_cache.invalidate()
+
+async def ingest_city(city: str, location: Optional[Dict] = None, n_stories: int = INGEST_STORIES, resume: bool = False) -> List[Dict]:
+    # Fetch, classify and store the positive news for one city. Stories that
+    # are already stored are not classified again; they are returned as they
+    # are when their stored sentiment is positive. The collection also holds
+    # articles from other sources (e.g. user uploads) with other sentiments.
+    candidate_news = await fetch_candidate_news(city, location, n_stories, resume)
+    candidate_news = list({news_data["source"]: news_data for news_data in candidate_news}.values())
+    known = await known_news([news_data["source"] for news_data in candidate_news])
+    new_positive = await keep_positive([news_data for news_data in candidate_news if news_data["source"] not in known])
+    await store_news(new_positive)
+
+    new_sources = {news_data["source"] for news_data in new_positive}
+    positive_news = []
+    for news_data in candidate_news:
+        if news_data["source"] in known:
+            if known[news_data["source"]].get("sentiment") == "positive":
+                positive_news.append(known[news_data["source"]])
+        elif news_data["source"] in new_sources:
+            positive_news.append(news_data)
+    print(f"{city}: {len(new_positive)} new positive stories, {len(known)} already stored")
+    return positive_news
+
+async def run_worker(cities: List[str] = INGEST_CITIES, interval_minutes: float = INGEST_INTERVAL_MINUTES, once: bool = False):
+    await check_connection()
+    await ensure_indexes(db)
+    while True:
+        started = datetime.utcnow()
+        for city in cities:
+            try:
+                await ingest_city(city, resume=True)
+            except Exception as e:
+                print(f"Ingestion error for {city}: {e}")
+        print(f"Ingestion run finished in {(datetime.utcnow() - started).total_seconds():.0f}s")
+        if once:
+            break
+        await asyncio.sleep(interval_minutes * 60)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker(once="--once" in sys.argv))
@@ -0,0 +1,184 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, errors
+from database import users_repo, good_deeds_repo, leaderboard_repo, leaderboard_daily_repo, snapshot_session
+
+# User fields copied next to the deed count so the leaderboard is a single read
+LEADER_FIELDS = ("name", "streak", "mood")
+
+# Days covered by each time window, counting today
+WINDOW_DAYS = {"week": 7, "month": 30}
+
+def day_bucket(moment):
+    return datetime(moment.year, moment.month, moment.day)
+
+async def record_deed(user_id, delta=1, completed_at=None, city=None):
+    # Add (or with delta=-1 remove) one good deed for a user: the all-time
+    # counter and the user's counter for that day and city, one atomic
+    # update each
+    user = await users_repo.find_one({"_id": user_id}, {field: 1 for field in LEADER_FIELDS})
+    fields = {"updated_at": datetime.utcnow()}
+    if user:
+        fields.update({field: user.get(field) for field in LEADER_FIELDS})
+    await leaderboard_repo.update_one(
+        {"_id": user_id},
+        {"$inc": {"deed_count": delta}, "$set": fields},
+        upsert=True
+    )
+    await leaderboard_daily_repo.update_one(
+        {"user_id": user_id, "day": day_bucket(completed_at or datetime.now()), "city": city},
+        {"$inc": {"deed_count": delta}},
+        upsert=True
+    )
+
+async def record_deeds(deeds):
+    # record_deed for many new deeds at once, given as (user_id, completed_at,
+    # city) tuples: one users query and one bulk write per counter collection
+    if not deeds:
+        return
+    totals = Counter(user_id for user_id, _, _ in deeds)
+    buckets = Counter((user_id, day_bucket(completed_at or datetime.now()), city) for user_id, completed_at, city in deeds)
+    users = await users_repo.find_many({"_id": {"$in": list(totals)}}, {field: 1 for field in LEADER_FIELDS})
+    users = {user["_id"]: user for user in users}
+    now = datetime.utcnow()
+
+    operations = []
+    for user_id, count in totals.items():
+        fields = {"updated_at": now}
+        if user_id in users:
+            fields.update({field: users[user_id].get(field) for field in LEADER_FIELDS})
+        operations.append(UpdateOne({"_id": user_id}, {"$inc": {"deed_count": count}, "$set": fields}, upsert=True))
+    await leaderboard_repo.bulk_write(operations, ordered=False)
+
+    await leaderboard_daily_repo.bulk_write([
+        UpdateOne({"user_id": user_id, "day": day, "city": city}, {"$inc": {"deed_count": count}}, upsert=True)
+        for (user_id, day, city), count in buckets.items()
+    ], ordered=False)
+
+async def _read_counts(session=None):
+    # What good_deeds says the counters should be, and what they are
+    totals = await good_deeds_repo.aggregate([
+        {"$group": {"_id": "$user_id", "deed_count": {"$sum": 1}}}
+    ], session=session)
+    buckets = await good_deeds_repo.aggregate([
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "day": {"$dateFromParts": {
+                    "year": {"$year": "$completed_at"},
+                    "month": {"$month": "$completed_at"},
+                    "day": {"$dayOfMonth": "$completed_at"}
+                }},
+                "city": {"$ifNull": ["$location.city", None]}
+            },
+            "deed_count": {"$sum": 1}
+        }}
+    ], session=session)
+    current_totals = await leaderboard_repo.find_many({}, {"deed_count": 1}, session=session)
+    current_buckets = await leaderboard_daily_repo.find_many({}, {"user_id": 1, "day": 1, "city": 1, "deed_count": 1}, session=session)
+    return totals, buckets, current_totals, current_buckets
+
+async def rebuild():
+    # Recount both counter collections from good_deeds. The deeds and the
+    # counters are read at one point in time and only the difference is
+    # applied with $inc, so good deeds created or deleted by a live API while
+    # this runs keep their own increments.
+    try:
+        async with await snapshot_session() as session:
+            totals, buckets, current_totals, current_buckets = await _read_counts(session)
+    except errors.PyMongoError as e:
+        # Standalone servers have no snapshot reads; counting without one can
+        # be off by the deeds written during the rebuild
+        print(f"Snapshot read unavailable ({e}), counting without one")
+        totals, buckets, current_totals, current_buckets = await _read_counts()
+
+    expected = {total["_id"]: total["deed_count"] for total in totals}
+    actual = {total["_id"]: total.get("deed_count", 0) for total in current_totals}
+    users = await users_repo.find_many({"_id": {"$in": list(expected)}}, {field: 1 for field in LEADER_FIELDS})
+    users = {user["_id"]: user for user in users}
+    now = datetime.utcnow()
+    operations = []
+    for user_id in set(expected) | set(actual):
+        fields = {"updated_at": now}
+        if user_id in users:
+            fields.update({field: users[user_id].get(field) for field in LEADER_FIELDS})
+        delta = expected.get(user_id, 0) - actual.get(user_id, 0)
+        operations.append(UpdateOne({"_id": user_id}, {"$inc": {"deed_count": delta}, "$set": fields}, upsert=True))
+    if operations:
+        await leaderboard_repo.bulk_write(operations, ordered=False)
+
+    expected = {(bucket["_id"]["user_id"], bucket["_id"]["day"], bucket["_id"]["city"]): bucket["deed_count"] for bucket in buckets}
+    actual = {(bucket.get("user_id"), bucket.get("day"), bucket.get("city")): bucket.get("deed_count", 0) for bucket in current_buckets}
+    operations = []
+    for user_id, day, city in set(expected) | set(actual):
+        delta = expected.get((user_id, day, city), 0) - actual.get((user_id, day, city), 0)
+        if delta:
+            operations.append(UpdateOne({"user_id": user_id, "day": day, "city": city}, {"$inc": {"deed_count": delta}}, upsert=True))
+    if operations:
+        await leaderboard_daily_repo.bulk_write(operations, ordered=False)
+    return {"users": len(totals), "buckets": len(buckets), "corrected_buckets": len(operations)}
+
+async def backfill_if_empty():
+    # The counters only follow good deeds written after they were introduced;
+    # fill them from the existing deeds the first time the API starts
+    if await leaderboard_repo.find_one({}) is None and await good_deeds_repo.find_one({}) is not None:
+        print(f"Leaderboard backfilled: {await rebuild()}")
+
+async def refresh_user(user_id, user_data):
+    # Keep the copied user fields in step when a user changes
+    fields = {field: user_data[field] for field in LEADER_FIELDS if field in user_data}
+    if fields:
+        await leaderboard_repo.update_one({"_id": user_id}, {"$set": fields})
+
+async def remove_user(user_id):
+    # The user's deeds stay in good_deeds, so the count stays too; without
+    # the copied name the entry is left out of the leaderboard
+    await leaderboard_repo.update_one({"_id": user_id}, {"$unset": {field: "" for field in LEADER_FIELDS}})
+
+async def top_leaders(n=10):
+    # Users without a profile are left out, like the original aggregation did
+    leaders = await leaderboard_repo.find_many(
+        {"deed_count": {"$gt": 0}, "name": {"$exists": True}},
+        sort=[("deed_count", -1)],
+        limit=n
+    )
+    return [
+        {
+            "user_id": leader["_id"],
+            "deed_count": leader["deed_count"],
+            "name": leader["name"],
+            "streak": leader.get("streak"),
+            "mood": leader.get("mood")
+        }
+        for leader in leaders
+    ]
+
+async def top_leaders_since(n=10, window=None, city=None):
+    # Sum the daily buckets of the window (and city) per user; all-time for
+    # the whole world is served by top_leaders instead
+    query = {}
+    if window:
+        query["day"] = {"$gte": day_bucket(datetime.now()) - timedelta(days=WINDOW_DAYS[window] - 1)}
+    if city:
+        query["city"] = city
+    pipeline = [
+        {"$match": query},
+        {"$group": {"_id": "$user_id", "deed_count": {"$sum": "$deed_count"}}},
+        {"$match": {"deed_count": {"$gt": 0}}},
+        {"$sort": {"deed_count": -1, "_id": 1}},
+        {"$lookup": {"from": leaderboard_repo.name, "localField": "_id", "foreignField": "_id", "as": "profile"}},
+        {"$unwind": "$profile"},
+        {"$match": {"profile.name": {"$exists": True}}},
+        {"$limit": n},
+    ]
+    leaders = await leaderboard_daily_repo.aggregate(pipeline)
+    return [
+        {
+            "user_id": leader["_id"],
+            "deed_count": leader["deed_count"],
+            "name": leader["profile"]["name"],
+            "streak": leader["profile"].get("streak"),
+            "mood": leader["profile"].get("mood")
+        }
+        for leader in leaders
+    ]
@@ -0,0 +1,72 @@
+from bson import json_util, Binary, Decimal128, ObjectId, Regex, Timestamp
+from datetime import datetime
+import base64
+import re
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Header carrying the cursor of the next page; absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(values):
+    # Opaque, URL-safe cursor holding the sort values of the last returned document.
+    # json_util keeps ObjectId and datetime values intact through the round trip.
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    # Raises ValueError for anything that was not produced by encode_cursor
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+# $type aliases in MongoDB's sort order across types. $gt and $lt only match
+# values of the compared value's type, so a field that mixes types (users'
+# _id is a string or an ObjectId) also needs the types sorting after it.
+BSON_TYPE_ORDER = ["null", "number", "string", "object", "array", "binData", "objectId", "bool", "date", "timestamp", "regex"]
+
+# Python types as json_util decodes cursor values, by position in BSON_TYPE_ORDER;
+# bool comes before int because bool is a subclass of it
+_TYPE_RANKS = [
+    (type(None), 0), (bool, 7), ((int, float, Decimal128), 1), (str, 2), (dict, 3), (list, 4),
+    ((bytes, Binary), 5), (ObjectId, 6), (datetime, 8), (Timestamp, 9), ((Regex, re.Pattern), 10),
+]
+
+def _type_rank(value):
+    for types, rank in _TYPE_RANKS:
+        if isinstance(value, types):
+            return rank
+    return None
+
+def _after(field, value, direction):
+    # Values of `field` strictly after `value` in `direction` order, of any type
+    conditions = [{field: {"$gt" if direction == 1 else "$lt": value}}]
+    rank = _type_rank(value)
+    if rank is not None:
+        later = range(rank + 1, len(BSON_TYPE_ORDER)) if direction == 1 else range(rank)
+        aliases = [BSON_TYPE_ORDER[later_rank] for later_rank in later if later_rank != 0]
+        if aliases:
+            conditions.append({field: {"$type": aliases}})
+        if 0 in later:
+            # Missing fields sort like null but don't match $type "null"
+            conditions.append({field: None})
+    return conditions[0] if len(conditions) == 1 else {"$or": conditions}
+
+def keyset_filter(sort, values):
+    # Documents that come strictly after `values` in `sort` order, e.g. for
+    # [(published_at, -1), (_id, -1)]:
+    #   published_at < v0  OR  (published_at == v0 AND _id < v1)
+    # where "<" also takes in the values of types that sort before v0's.
+    if len(values) != len(sort):
+        raise ValueError("Invalid cursor")
+    clauses = []
+    for index, (field, direction) in enumerate(sort):
+        clause = {previous_field: value for (previous_field, _), value in zip(sort[:index], values[:index])}
+        after = _after(field, values[index], direction)
+        clauses.append({"$and": [clause, after]} if clause else after)
+    return {"$or": clauses}
@@ -0,0 +1,49 @@
+# Partial documents for the list endpoints: ?fields=title,location.city or
+# ?view=summary. MongoDB reads and returns only those fields, and "id" (the
+# string form of _id) is always included.
+
+NEWS_FIELDS = (
+    "title", "content", "location", "location.city", "location.state", "location.country",
+    "location.coordinates", "sentiment", "published_at", "source"
+)
+# What the news feed shows
+NEWS_SUMMARY_FIELDS = ("title", "location.city", "published_at")
+
+GOOD_DEED_FIELDS = (
+    "user_id", "title", "description", "location", "location.city", "location.state",
+    "location.country", "location.coordinates", "completed_at", "streak_continued", "replies"
+)
+GOOD_DEED_SUMMARY_FIELDS = ("user_id", "title", "location.city", "completed_at")
+
+def selected_fields(view, fields, allowed, summary):
+    # The fields to return, or None for whole documents.
+    # Raises ValueError for fields that are not in `allowed`.
+    if fields:
+        selected = [field.strip() for field in fields.split(",") if field.strip() and field.strip() != "id"]
+        unknown = [field for field in selected if field not in allowed]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    elif view == "summary":
+        selected = list(summary)
+    else:
+        return None
+    # A whole subdocument already contains its fields, and MongoDB rejects both
+    # in one projection
+    return [field for field in dict.fromkeys(selected) if field.split(".")[0] == field or field.split(".")[0] not in selected]
+
+def project_stage(selected, keep=()):
+    # $project for the selected fields. `keep` holds fields that are needed
+    # after the query (such as the sort fields for the next-page cursor) and
+    # are removed again with strip_kept.
+    projection = {"id": {"$toString": "$_id"}}
+    projection.update({field: 1 for field in list(selected) + list(keep)})
+    if "_id" not in keep:
+        projection["_id"] = 0
+    return {"$project": projection}
+
+def strip_kept(documents, selected, keep):
+    for document in documents:
+        for field in keep:
+            if field not in selected:
+                document.pop(field, None)
+    return documents
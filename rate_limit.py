@@ -0,0 +1,131 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import asyncio
+import os
+import threading
+import time
+
+# Our OpenAI quota; the bucket refills at this rate
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 3000))
+# Upper bound for calls in flight; the adaptive window moves below it
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 16))
+# How often a throttled call is tried again before its error is raised
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 5))
+# A call that takes longer is given up, so it can't hold its slot forever
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", 30))
+
+# Pause after a 429 that came without a Retry-After header
+DEFAULT_PAUSE_SECONDS = 1.0
+# How often a caller waiting for a free slot checks again
+SLOT_POLL_SECONDS = 0.05
+
+
+def retry_after_seconds(headers):
+    # Seconds from Retry-After (seconds or an HTTP date) or OpenAI's
+    # retry-after-ms, or None when neither is usable
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    # A token bucket keeps the request rate under the quota, and an AIMD window
+    # bounds the calls in flight: every success widens the window by about one
+    # call per window's worth of successes, and a congestion event halves it
+    # and pauses all callers for the Retry-After time. The 429s of calls that
+    # started before the last decrease belong to the same event and only
+    # extend the pause. Works from threads and from asyncio.
+    def __init__(self, requests_per_minute=OPENAI_REQUESTS_PER_MINUTE, max_concurrency=OPENAI_MAX_CONCURRENCY, min_concurrency=1):
+        self.rate = requests_per_minute / 60
+        # Up to one second of requests may go out back to back
+        self.burst = max(1.0, self.rate)
+        self.tokens = self.burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.window = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.decreased_at = float("-inf")
+        self.succeeded = 0
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self):
+        # (0, start time) if a call may start now (its slot and token are
+        # taken), otherwise (seconds to wait before trying again, None)
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now, None
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.in_flight >= int(self.window):
+                return SLOT_POLL_SECONDS, None
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate, None
+            self.tokens -= 1
+            self.in_flight += 1
+            return 0, now
+
+    def acquire(self):
+        # Blocks until the call may start; pass the returned ticket to release
+        wait, ticket = self._try_acquire()
+        while wait > 0:
+            time.sleep(wait)
+            wait, ticket = self._try_acquire()
+        return ticket
+
+    async def acquire_async(self):
+        wait, ticket = self._try_acquire()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait, ticket = self._try_acquire()
+        return ticket
+
+    def release(self, ticket, status="ok", retry_after=None):
+        # status is "ok", "throttled" (a 429) or "error" (anything else, which
+        # says nothing about our rate and leaves the window alone)
+        with self._lock:
+            self.in_flight -= 1
+            if status == "ok":
+                self.succeeded += 1
+                self.window = min(self.max_concurrency, self.window + 1 / self.window)
+            elif status == "throttled":
+                self.throttled += 1
+                if ticket >= self.decreased_at:
+                    self.window = max(self.min_concurrency, self.window / 2)
+                    self.decreased_at = time.monotonic()
+                pause = DEFAULT_PAUSE_SECONDS if retry_after is None else retry_after
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                # No burst right after the pause
+                self.tokens = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "window": round(self.window, 2),
+                "in_flight": self.in_flight,
+                "succeeded": self.succeeded,
+                "throttled": self.throttled
+            }
+
+
+# Shared by every OpenAI call in the process: classification and TTS
+openai_limiter = AdaptiveLimiter()
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from fastapi.encoders import jsonable_encoder
+import hashlib
+import json
+import os
+import time
+
+# How long a cached news response is served before it is rebuilt. Writes made
+# by this process clear the cache right away; the TTL bounds how stale the
+# cache can get when another process (e.g. the ingestion worker) writes news.
+NEWS_CACHE_TTL_SECONDS = float(os.getenv("NEWS_CACHE_TTL_SECONDS", 60))
+
+
+class CachedResponse:
+    def __init__(self, body, headers, expires_at):
+        self.body = body
+        self.headers = headers
+        self.expires_at = expires_at
+        # Strong validator: the exact bytes of the body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+    def matches(self, if_none_match):
+        # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+class ResponseCache:
+    # Keeps serialized JSON responses of read endpoints in memory, keyed by the
+    # route and its parameters, until they expire or a write invalidates them.
+    def __init__(self, ttl_seconds=NEWS_CACHE_TTL_SECONDS, max_entries=1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Bumped on every invalidation so a response built from data read
+        # before the write is not stored afterwards
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(route, **params):
+        return (route,) + tuple(sorted(params.items()))
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key, payload, headers=None, generation=None):
+        body = json.dumps(
+            jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+        entry = CachedResponse(body, dict(headers or {}), time.monotonic() + self.ttl_seconds)
+        if generation is None or generation == self.generation:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+# Shared by the news read endpoints and everything that writes news
+news_cache = ResponseCache()
@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 import pymongo
+from indexes import ensure_indexes_sync
 import re
 from bson.objectid import ObjectId
 from datetime import datetime
@@ -448,12 +449,14 @@ def delete_document(collection):
     except pymongo.errors.PyMongoError as e:
         print(f"An error occurred while deleting the document from {collection.name}: {e}")
 
-def remove_duplicate_news_by_title():
+def remove_duplicate_news(field="title"):
     try:
-        # Use aggregation to group by title and find duplicates
+        # Use aggregation to group by the field and find duplicates
         pipeline = [
+            # Articles without a value are not duplicates of each other
+            {"$match": {field: {"$type": "string"}}},
             {"$group": {
-                "_id": "$title",
+                "_id": f"${field}",
                 "ids": {"$push": "$_id"},
                 "count": {"$sum": 1}
             }},
@@ -463,21 +466,32 @@ def remove_duplicate_news_by_title():
         duplicates = list(news.aggregate(pipeline))
 
         if not duplicates:
-            print("No duplicate news articles found.")
+            print(f"No duplicate news articles found by {field}.")
             return
 
-        # Remove duplicates, keeping one document for each title
+        # Remove duplicates, keeping one document for each value
         for duplicate in duplicates:
             ids = duplicate["ids"]
             # Keep the first ID and remove others
             ids_to_remove = ids[1:]
             result = news.delete_many({"_id": {"$in": ids_to_remove}})
-            print(f"Removed {result.deleted_count} duplicate(s) for title: '{duplicate['_id']}'.")
+            print(f"Removed {result.deleted_count} duplicate(s) for {field}: '{duplicate['_id']}'.")
 
         print("Duplicate removal process completed.")
     except pymongo.errors.PyMongoError as e:
         print(f"An error occurred while removing duplicate news articles: {e}")
 
+def rebuild_leaderboard():
+    # Recount the leaderboard counters from good_deeds, e.g. after importing
+    # good deeds directly; safe while the API is running
+    import asyncio
+    import leaderboard
+    try:
+        ensure_indexes_sync(db)
+        print(f"Leaderboard rebuilt: {asyncio.run(leaderboard.rebuild())}")
+    except pymongo.errors.PyMongoError as e:
+        print(f"An error occurred while rebuilding the leaderboard: {e}")
+
 
 def main():
     while True:
@@ -498,10 +512,12 @@ def main():
         print("14. Delete a good deed")
         print("15. Delete a news article")
         print("16. Delete a reply")
-        print("17. Remove duplicate news by title")  # New option
-        print("18. Exit")  # Updated option number
+        print("17. Remove duplicate news by title and source")
+        print("18. Create database indexes")
+        print("19. Rebuild leaderboard")  # New option
+        print("20. Exit")  # Updated option number
 
-        choice = input("Enter your choice (1-18): ")
+        choice = input("Enter your choice (1-20): ")
 
         if choice == '1':
             add_user()
@@ -536,8 +552,14 @@ def main():
         elif choice == '16':
             delete_reply()
         elif choice == '17':
-            remove_duplicate_news_by_title()
+            remove_duplicate_news("title")
+            # The unique source index can only be created without these
+            remove_duplicate_news("source")
         elif choice == '18':
+            ensure_indexes_sync(db)
+        elif choice == '19':
+            rebuild_leaderboard()
+        elif choice == '20':
             break
         else:
             print("Invalid choice. Please try again.")
@@ -1,85 +1,49 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import List, Dict
+import asyncio
+import json
 import requests
 import os
 from dotenv import load_dotenv
+from classifier import is_political, analyze_sentiment, prefilter_stats
 
 app = FastAPI()
 load_dotenv()
 
-API_ENDPOINT = os.getenv("OPEN_AI_API_ENDPOINT")
-API_KEY = os.getenv("OPEN_AI_API_KEY")
+# Maximum number of articles classified at the same time
+CLASSIFY_CONCURRENCY = int(os.getenv("CLASSIFY_CONCURRENCY", 8))
+
+async def classify_in_order(articles: List[Dict[str, str]], concurrency: int = CLASSIFY_CONCURRENCY):
+    # Classify up to `concurrency` articles at once and yield one NDJSON line
+    # per article in submission order, each as soon as it and the ones
+    # before it are done. A failed article gets an error line instead.
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def classify(article):
+        async with semaphore:
+            return await asyncio.to_thread(analyze_sentiment, article["content"])
+
+    tasks = [asyncio.create_task(classify(article)) for article in articles]
+    try:
+        for index, task in enumerate(tasks):
+            try:
+                line = {"index": index, "sentiment": await task}
+            except Exception as e:
+                print(f"Error classifying article {index}: {e}")
+                line = {"index": index, "error": str(e)}
+            yield json.dumps(line) + "\n"
+    finally:
+        # The client went away: don't start the articles that are still waiting
+        for task in tasks:
+            task.cancel()
 
-headers = {
-    "Content-Type": "application/json",
-    "Authorization": f"Bearer {API_KEY}"
-}
-def is_political(text: str) -> bool:
-    messages = [
-        {"role": "system", "content": "You are a helpful assistant that determines if text is related to politics."},
-        {"role": "user", "content": f"Is this text related to politics? Answer with just 'yes' or 'no':\n\n{text}"}
-    ]
-    
-    data = {
-        "model": "gpt-3.5-turbo", 
-
-        "messages": messages,
-        "max_tokens": 10,
-        "temperature": 0.3,
-        "top_p": 1,
-        "frequency_penalty": 0,
-        "presence_penalty": 0,
-        "stop": None,
-        "stream": False
-    }
-
-    response = requests.post(API_ENDPOINT, headers=headers, json=data)
-    
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=f"Error from Azure OpenAI API: {response.text}")
-    
-    result = response.json()
-    is_political = result["choices"][0]["message"]["content"].strip().lower() == "yes"
-    return is_political
-
-def analyze_sentiment(text: str) -> str:
-
-    messages = [
-        {"role": "system", "content": "You are a helpful assistant that performs sentiment analysis."},
-        {"role": "user", "content": f"Analyze the sentiment of this text and return just one word, 'positive' if it's happy or positive, else return 'negative' if it's sad or dangerous otherwise 'neutral':\n\n{text}"}
-
-    ]
-    
-    data = {
-        "model": "gpt-3.5-turbo",  
-
-        "messages": messages,
-        "max_tokens":800,  
-        "temperature":0.7,  
-        "top_p":0.95,  
-        "frequency_penalty":0,  
-        "presence_penalty":0,  
-        "stop":None,  
-        "stream":False  
-    }
-
-    response = requests.post(API_ENDPOINT, headers=headers, json=data)
-    
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=f"Error from Azure OpenAI API: {response.text}")
-        
-    
-    result = response.json()
-    sentiment = result["choices"][0]["message"]["content"].strip().lower()
-    if sentiment == "positive" and is_political(text):
-        return "neutral"
-    
-    return sentiment
 @app.post("/analyze_sentiment/")
 async def filter_happy_articles(articles: List[Dict[str, str]]):
-    happy_articles = []
-    for article in articles:
-        sentiment = analyze_sentiment(article["content"])
-        happy_articles.append(sentiment)
-    
-    return {"happy_articles": happy_articles}
+    if any("content" not in article for article in articles):
+        raise HTTPException(status_code=400, detail="Every article needs a content field")
+    return StreamingResponse(classify_in_order(articles), media_type="application/x-ndjson")
+
+@app.get("/prefilter_stats/")
+async def get_prefilter_stats():
+    return prefilter_stats()
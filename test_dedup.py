@@ -0,0 +1,80 @@
+# Pins remove_duplicates (MinHash-LSH) against the original all-pairs scan
+# (exact=True): every fixture must keep the same stories in the same order.
+# Run with: python -m pytest test_dedup.py
+import pytest
+
+from dedup import remove_duplicates
+
+CITY = "Minneapolis-Saint Paul"
+
+# Different stories whose titles share the searched city, which alone makes
+# their SequenceMatcher ratio pass the 0.5 threshold
+CITY_TITLES = [
+    f"{CITY}: nurse retires after 40 years",
+    f"{CITY}: bakery feeds the homeless",
+    f"{CITY}: teen wins science fair",
+    f"{CITY}: zoo welcomes baby giraffe",
+    f"{CITY}: volunteers plant 500 trees",
+    f"{CITY}: mayor opens new bridge",
+]
+
+# The same story as syndicated by other outlets
+SYNDICATED_TITLES = [
+    ("Seattle teen raises $10,000 for local food bank", "Seattle teen raises $10K for local food bank"),
+    ("Volunteers rescue stranded dolphins on Cape Cod beach", "Volunteers rescued stranded dolphins on a Cape Cod beach"),
+    ("City library opens free coding classes for seniors", "City library opens free coding class for seniors - KOMO News"),
+    ("Firefighters save family dog from burning home in Tacoma", "Tacoma firefighters save family dog from burning home"),
+]
+
+# One story syndicated six ways among five others
+WIDELY_SYNDICATED_TITLES = [
+    "Retired teacher tutors kids for free in Boise",
+    "Zoo welcomes baby giraffe in Denver",
+    "Retired teacher tutors kids for free in Boise - KTVB",
+    "Hikers clean up trash along Appalachian Trail",
+    "WATCH: Retired teacher tutors kids for free in Boise",
+    "Retired Boise teacher tutors kids for free",
+    "Bus driver returns lost wallet to rider",
+    "Retired teacher tutors kids for free in Boise | AP",
+    "Coffee shop hires adults with disabilities",
+    "Retired teacher tutoring kids for free in Boise (VIDEO)",
+    "Farmers donate harvest to food pantries",
+]
+
+FIXTURES = {
+    "small batch": [
+        "Seattle teen raises $10,000 for local food bank",
+        "Zoo welcomes baby giraffe in Denver",
+        "Seattle teen raises $10K for local food bank",
+    ],
+    "widely syndicated": WIDELY_SYNDICATED_TITLES,
+    "city titles": CITY_TITLES,
+    "syndicated variants": [original for original, _ in SYNDICATED_TITLES] + [variant for _, variant in SYNDICATED_TITLES],
+    "syndicated among city titles": CITY_TITLES[:1] + [original for original, _ in SYNDICATED_TITLES] + CITY_TITLES[1:]
+        + [variant for _, variant in SYNDICATED_TITLES] + [f"{CITY}: zoo welcomes a baby giraffe"],
+}
+
+
+def stories(titles):
+    return [{"title": title, "source": f"https://example.com/{index}"} for index, title in enumerate(titles)]
+
+
+def titles(stories):
+    return [story["title"] for story in stories]
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+@pytest.mark.parametrize("threshold", [0.5, 0.7])
+def test_same_stories_as_exact(name, threshold):
+    batch = stories(FIXTURES[name])
+    assert titles(remove_duplicates(batch, threshold)) == titles(remove_duplicates(batch, threshold, exact=True))
+
+
+def test_syndicated_variants_are_dropped():
+    batch = stories(FIXTURES["syndicated variants"])
+    assert titles(remove_duplicates(batch)) == [original for original, _ in SYNDICATED_TITLES]
+
+
+def test_small_and_widely_syndicated_batches():
+    assert len(remove_duplicates(stories(FIXTURES["small batch"]))) == 2
+    assert len(remove_duplicates(stories(WIDELY_SYNDICATED_TITLES))) == 6